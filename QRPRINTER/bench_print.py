@@ -0,0 +1,255 @@
+"""
+Load test for the /print pipeline - HTTP throughput/latency and file-to-QR latency
+
+Examples:
+    python bench_print.py --requests 1000 --concurrency 16
+    python bench_print.py --rate 50 --duration 30 --payloads hebrew
+    python bench_print.py --files 200 --output results.json
+
+Start the printer service (and the file watcher for --files) first.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from datetime import datetime
+import requests
+
+PRINTER_SERVICE_URL = "http://localhost:5000"
+PRINT_INPUT_DIR = "print_input"
+PRINT_ARCHIVE_DIR = "print_archive"
+PRINT_PENDING_DIR = "print_pending"
+
+# Realistic payloads: short tickets, Hebrew receipts, and near single-QR capacity
+PAYLOADS = {
+    'short': lambda: f"Order #{random.randint(1000, 99999)} - Table {random.randint(1, 40)}",
+    'hebrew': lambda: "".join(
+        f"פריט {i} - מחיר {random.randint(5, 500)} ש\"ח\n" for i in range(random.randint(10, 25))
+    ),
+    'near_capacity': lambda: "".join(random.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789 ") for _ in range(2200)),
+}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies, started, finished, errors, statuses):
+    """Throughput and latency percentiles (ms) for one scenario"""
+    latencies = sorted(latencies)
+    elapsed = finished - started
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'completed': len(latencies),
+        'errors': errors,
+        'status_codes': statuses,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_per_s': round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        'latency_ms': {
+            'min': ms(latencies[0] if latencies else None),
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+            'mean': ms(sum(latencies) / len(latencies) if latencies else None),
+        },
+    }
+
+
+def pick_payload(names):
+    name = random.choice(names)
+    return name, PAYLOADS[name]()
+
+
+def run_http(url, total, concurrency, rate, duration, payload_names, use_async, timeout):
+    """Drive POST /print from concurrency threads, optionally paced at rate requests/s"""
+    endpoint = f"{url}/print" + ("?async=1" if use_async else "")
+    lock = threading.Lock()
+    latencies, statuses = [], {}
+    counters = {'issued': 0, 'errors': 0}
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+
+    def next_slot():
+        """Index of the next request to send, or None when the run is over"""
+        with lock:
+            index = counters['issued']
+            if deadline is None and index >= total:
+                return None
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            counters['issued'] += 1
+            return index
+
+    def worker():
+        session = requests.Session()
+        while True:
+            index = next_slot()
+            if index is None:
+                return
+            if rate:
+                # Open loop: request i is due at started + i / rate
+                delay = started + index / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            _, content = pick_payload(payload_names)
+            sent = time.perf_counter()
+            try:
+                response = session.post(endpoint, json={'content': content}, timeout=timeout)
+                elapsed = time.perf_counter() - sent
+                with lock:
+                    statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+                    if response.status_code in (200, 202):
+                        latencies.append(elapsed)
+                    else:
+                        counters['errors'] += 1
+            except requests.exceptions.RequestException:
+                with lock:
+                    counters['errors'] += 1
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarize(latencies, started, time.perf_counter(), counters['errors'], statuses)
+
+
+def _spooled_names(directory):
+    """Original names of the print files in a spool directory, where they are kept as <ns>-<name>"""
+    try:
+        return {name.split('-', 1)[-1] for name in os.listdir(directory)}
+    except FileNotFoundError:
+        return set()
+
+
+def run_files(input_dir, archive_dir, pending_dir, total, rate, payload_names, timeout):
+    """
+    Drop print files into input_dir and time until each one shows up in
+    archive_dir, where the watcher moves it once its QR code exists. A poller
+    thread checks while files are still being dropped, so a file's latency
+    does not include the rest of the drop period. Files set aside as failed
+    (pending_dir/failed), and files still spooled for retry (pending_dir) or
+    still in input_dir at their timeout, are counted apart from successes.
+    """
+    os.makedirs(input_dir, exist_ok=True)
+    failed_dir = os.path.join(pending_dir, 'failed')
+    lock = threading.Lock()
+    dropped_files = {}  # Filename -> time it was dropped, until it is accounted for
+    latencies = []
+    outcomes = {'failed': 0, 'pending': 0, 'timed_out': 0}
+    dropping = threading.Event()
+    dropping.set()
+
+    def poll():
+        while True:
+            with lock:
+                waiting = list(dropped_files.items())
+            if not waiting and not dropping.is_set():
+                return
+            failed = _spooled_names(failed_dir) if waiting else set()
+            now = time.perf_counter()
+            for name, dropped in waiting:
+                if os.path.exists(os.path.join(archive_dir, name)):
+                    outcome = None
+                    latencies.append(now - dropped)
+                elif name in failed:
+                    outcome = 'failed'
+                elif now - dropped > timeout:
+                    outcome = 'pending' if name in _spooled_names(pending_dir) else 'timed_out'
+                else:
+                    continue
+                with lock:
+                    del dropped_files[name]
+                    if outcome:
+                        outcomes[outcome] += 1
+            time.sleep(0.01)
+
+    poller = threading.Thread(target=poll, daemon=True)
+    started = time.perf_counter()
+    poller.start()
+    for index in range(total):
+        if rate:
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        _, content = pick_payload(payload_names)
+        name = f"bench_{uuid.uuid4().hex}.txt"
+        dropped = time.perf_counter()
+        with lock:
+            dropped_files[name] = dropped
+        with open(os.path.join(input_dir, name), 'w', encoding='utf-8') as f:
+            f.write(content)
+    dropping.clear()
+    poller.join()
+
+    result = summarize(latencies, started, time.perf_counter(), sum(outcomes.values()), {})
+    result.update(outcomes)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the QR printer /print pipeline")
+    parser.add_argument('--url', default=PRINTER_SERVICE_URL, help="printer service base URL")
+    parser.add_argument('--requests', type=int, default=500, help="number of HTTP requests")
+    parser.add_argument('--concurrency', type=int, default=8, help="parallel HTTP clients")
+    parser.add_argument('--rate', type=float, default=None, help="target requests (or files) per second")
+    parser.add_argument('--duration', type=float, default=None, help="run HTTP load for this many seconds")
+    parser.add_argument('--payloads', default=','.join(PAYLOADS), help="comma-separated payload kinds")
+    parser.add_argument('--async', dest='use_async', action='store_true', help="use /print?async=1")
+    parser.add_argument('--files', type=int, default=0, help="also drop this many files into the input dir")
+    parser.add_argument('--input-dir', default=PRINT_INPUT_DIR, help="directory watched by the file watcher")
+    parser.add_argument('--archive-dir', default=PRINT_ARCHIVE_DIR, help="where the watcher moves printed files")
+    parser.add_argument('--pending-dir', default=PRINT_PENDING_DIR, help="where the watcher spools failed files")
+    parser.add_argument('--timeout', type=float, default=30, help="per request / per file timeout (s)")
+    parser.add_argument('--skip-http', action='store_true', help="only run the file scenario")
+    parser.add_argument('--output', help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    payload_names = [name.strip() for name in args.payloads.split(',') if name.strip()]
+    unknown = [name for name in payload_names if name not in PAYLOADS]
+    if unknown:
+        parser.error(f"unknown payloads: {', '.join(unknown)} (choose from {', '.join(PAYLOADS)})")
+
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'url': args.url,
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'rate': args.rate,
+            'duration': args.duration,
+            'payloads': payload_names,
+            'async': args.use_async,
+            'files': args.files,
+        },
+    }
+
+    if not args.skip_http:
+        print(f"HTTP: {args.duration or args.requests} {'s' if args.duration else 'requests'} "
+              f"at concurrency {args.concurrency}...", file=sys.stderr)
+        report['http'] = run_http(args.url, args.requests, args.concurrency, args.rate, args.duration,
+                                  payload_names, args.use_async, args.timeout)
+    if args.files:
+        print(f"Files: {args.files} files into {os.path.abspath(args.input_dir)}...", file=sys.stderr)
+        report['files'] = run_files(args.input_dir, args.archive_dir, args.pending_dir, args.files, args.rate,
+                                    payload_names, args.timeout)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+        print(f"Report written to {args.output}", file=sys.stderr)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmark the QR renderer against the original qrcode make_image() path
+
+Usage: python bench_render.py [rounds] [--json] [--versions]
+
+--versions times building the module matrix instead, at a spread of QR
+versions: qrcode's make(fit=True) against build_matrix() with the mask
+scored and with the fixed mask.
+"""
+import io
+import sys
+import json
+import time
+import random
+import qrcode
+from PIL import Image
+import qr_render
+
+# Payloads covering small, medium and near-capacity QR versions
+PAYLOADS = {
+    'short_ascii': "Order #12345 - Table 7",
+    'hebrew_text': "שלום עולם - קבלה מספר 12345\n" * 12,
+    'long_ascii': "Receipt line item 0123456789 ABCDEFGHIJ\n" * 40,
+    'near_capacity': "x" * 2300,
+}
+# Versions of the --versions benchmark, and the mask of its fixed-mask column
+VERSIONS = (1, 5, 10, 15, 20, 25, 30, 35, 40)
+FIXED_MASK = 0
+
+
+def make_qr(data):
+    """Build the symbol the way both paths do before drawing it"""
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qr_render.ERROR_CORRECTION,
+        box_size=qr_render.BOX_SIZE,
+        border=qr_render.BORDER,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def image_legacy(qr):
+    """The original path: make_image() draws each module, PIL saves with default settings"""
+    img = qr.make_image(fill_color="black", back_color="white")
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def image_fast(qr):
+    return qr_render.matrix_to_png(qr.get_matrix())
+
+
+def decode_pixels(png):
+    """Size and pixel data of a PNG, to check that both paths draw the same image"""
+    img = Image.open(io.BytesIO(png))
+    return img.size, img.convert('1').tobytes()
+
+
+def best_time(func, arg, rounds):
+    """Best wall time of rounds calls, and the result of the last one"""
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmark(rounds=5):
+    """Time the make stage and both image stages on every payload"""
+    results = []
+    for name, data in PAYLOADS.items():
+        make_time, qr = best_time(make_qr, data, rounds)
+        legacy_time, legacy_png = best_time(image_legacy, qr, rounds)
+        fast_time, fast_png = best_time(image_fast, qr, rounds)
+        results.append({
+            'payload': name,
+            'version': qr.version,
+            'make_ms': round(make_time * 1000, 2),
+            'legacy_image_ms': round(legacy_time * 1000, 2),
+            'fast_image_ms': round(fast_time * 1000, 2),
+            'image_speedup': round(legacy_time / fast_time, 2),
+            'legacy_bytes': len(legacy_png),
+            'fast_bytes': len(fast_png),
+            'pixel_identical': decode_pixels(legacy_png) == decode_pixels(fast_png),
+        })
+    return results
+
+
+def version_payload(version):
+    """Random lowercase text filling version as a byte segment - it needs exactly that version"""
+    bits = qrcode.util.BIT_LIMIT_TABLE[qr_render.ERROR_CORRECTION][version]
+    length = (bits - 4 - qrcode.util.length_in_bits(qrcode.util.MODE_8BIT_BYTE, version)) // 8
+    rng = random.Random(version)
+    return ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(length))
+
+
+def legacy_matrix(data, mask_pattern=None):
+    """Matrix as qrcode builds it - best_fit(), then each mask laid out and scored in Python"""
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qr_render.ERROR_CORRECTION,
+        border=qr_render.BORDER,
+        mask_pattern=mask_pattern,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def run_version_benchmark(rounds=5, versions=VERSIONS):
+    """Time building the matrix of a full symbol of each version, both ways"""
+    results = []
+    for version in versions:
+        data = version_payload(version)
+        legacy_time, legacy = best_time(legacy_matrix, data, rounds)
+        fast_time, fast = best_time(qr_render.build_matrix, data, rounds)
+        fixed_time, fixed = best_time(lambda d: qr_render.build_matrix(d, mask_pattern=FIXED_MASK), data, rounds)
+        results.append({
+            'version': qr_render.matrix_version(fast),
+            'bytes': len(data),
+            'qrcode_ms': round(legacy_time * 1000, 2),
+            'scored_ms': round(fast_time * 1000, 2),
+            'fixed_mask_ms': round(fixed_time * 1000, 2),
+            'scored_speedup': round(legacy_time / fast_time, 2),
+            'fixed_mask_speedup': round(legacy_time / fixed_time, 2),
+            # Same version and mask as qrcode picks - the symbol is module for module the same
+            'identical': fast == legacy and fixed == legacy_matrix(data, FIXED_MASK),
+        })
+    return results
+
+
+if __name__ == '__main__':
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() else 5
+    if '--versions' in sys.argv:
+        results = run_version_benchmark(rounds)
+        if '--json' in sys.argv:
+            print(json.dumps(results, indent=2))
+            sys.exit(0)
+        print(f"Mask scoring: {'numpy' if qr_render.numpy is not None else 'pure Python (pip install numpy)'}")
+        print(f"{'ver':>4}{'bytes':>7}{'qrcode ms':>11}{'scored ms':>11}{'fixed ms':>10}"
+              f"{'scored x':>10}{'fixed x':>9}  identical")
+        for r in results:
+            print(f"{r['version']:>4}{r['bytes']:>7}{r['qrcode_ms']:>11}{r['scored_ms']:>11}{r['fixed_mask_ms']:>10}"
+                  f"{r['scored_speedup']:>10}{r['fixed_mask_speedup']:>9}  {r['identical']}")
+        sys.exit(0)
+    results = run_benchmark(rounds)
+    if '--json' in sys.argv:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'payload':<15}{'ver':>4}{'make ms':>9}{'legacy ms':>11}{'fast ms':>9}{'speedup':>9}"
+              f"{'legacy B':>10}{'fast B':>9}  identical")
+        for r in results:
+            print(f"{r['payload']:<15}{r['version']:>4}{r['make_ms']:>9}{r['legacy_image_ms']:>11}"
+                  f"{r['fast_image_ms']:>9}{r['image_speedup']:>9}{r['legacy_bytes']:>10}{r['fast_bytes']:>9}"
+                  f"  {r['pixel_identical']}")
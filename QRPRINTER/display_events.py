@@ -0,0 +1,92 @@
+"""
+Display Events - Pushes new print jobs to connected display screens (Server-Sent Events)
+"""
+import json
+import queue
+import threading
+
+# Seconds between keep-alive comments on an idle stream
+HEARTBEAT_INTERVAL = 15
+# Milliseconds the browser waits before reconnecting a dropped stream
+RECONNECT_DELAY = 2000
+# Seconds a screen turned away because all stream slots are taken waits before trying again
+RETRY_FULL_AFTER = 60
+
+
+class JobEventBroker:
+    """Fan out the latest job to every subscribed screen, at most max_subscribers of them (None for no limit)"""
+
+    def __init__(self, max_subscribers=None):
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._latest = None
+
+    @property
+    def latest(self):
+        return self._latest
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def has_room(self):
+        """Whether another screen may subscribe - each one holds a server thread"""
+        return self.max_subscribers is None or self.subscriber_count() < self.max_subscribers
+
+    def subscribe(self):
+        """Register a screen, returns its event queue primed with the current job"""
+        events = queue.Queue(maxsize=8)
+        with self._lock:
+            self._subscribers.add(events)
+            if self._latest is not None:
+                events.put_nowait(self._latest)
+        return events
+
+    def unsubscribe(self, events):
+        with self._lock:
+            self._subscribers.discard(events)
+
+    def publish(self, event):
+        """Send an event to every screen - slow screens only keep the newest events"""
+        with self._lock:
+            self._latest = event
+            subscribers = list(self._subscribers)
+        for events in subscribers:
+            while True:
+                try:
+                    events.put_nowait(event)
+                    break
+                except queue.Full:
+                    try:
+                        events.get_nowait()
+                    except queue.Empty:
+                        pass
+
+    def stream(self, heartbeat=HEARTBEAT_INTERVAL):
+        """Generator producing the text/event-stream body for one screen"""
+        events = self.subscribe()
+        try:
+            yield f"retry: {RECONNECT_DELAY}\n\n"
+            while True:
+                try:
+                    event = events.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            self.unsubscribe(events)
+
+
+def event_stream_full_response():
+    """Body, status and headers turning a screen away when every stream slot is taken - it polls instead"""
+    return 'Too many screens connected - poll /api/latest\n', 503, {'Retry-After': str(RETRY_FULL_AFTER)}
+
+
+def event_stream_headers():
+    """Headers that stop browsers and proxies from caching or buffering the stream"""
+    return {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    }
@@ -3,37 +3,209 @@ Display Server - Shows the latest QR code for 10 seconds then disappears
 """
 import os
 import time
-from flask import Flask, send_file, jsonify
+import argparse
+import threading
+from flask import Flask, Response, request, jsonify, stream_with_context
 from datetime import datetime
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+from display_events import JobEventBroker, event_stream_full_response, event_stream_headers
+from job_storage import JobStorage, symbol_filenames
+from job_index import DONE, JOB_INDEX_FILE, JobIndex
+from job_archive import ARCHIVE_DIR
+from http_cache import job_json_response, send_job_bytes, send_job_file
+from http_compress import StaticPage, compress_app
+from qr_render import MIMETYPES as QR_MIMETYPES, qr_data_uri
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, instrument_app
+from serving import SCREENS, add_server_arguments, serve
 
 app = Flask(__name__)
 
 QR_OUTPUT_DIR = "qr_codes"
 PRINT_CONTENT_DIR = "print_content"
 COUNTER_FILE = "counter.txt"
+# QR formats the printer may write, in the order the display prefers them
+QR_FORMATS = ('png', 'svg')
 
+# Per-job files, in the printer's sharded layout (flat files are still found)
+qr_storage = JobStorage(QR_OUTPUT_DIR)
+content_storage = JobStorage(PRINT_CONTENT_DIR)
+# The printer's job index - read only, jobs from before it are found by their files
+job_index = JobIndex(JOB_INDEX_FILE, create=False)
 
-def get_latest_qr_filename():
-    """Get the filename of the latest QR code"""
+# Pushes new jobs to connected screens
+job_events = JobEventBroker(max_subscribers=SCREENS)
+
+# Request counts and latency of the display routes, served on /metrics
+metrics = MetricsRegistry('qrdisplay_')
+compress_app(app)
+instrument_app(app, metrics)
+DISPLAY_CLIENTS = metrics.gauge('event_subscribers', 'Screens connected to /api/events')
+
+
+@metrics.on_collect
+def collect_display_clients():
+    DISPLAY_CLIENTS.set(job_events.subscriber_count())
+
+
+def latest_job_number():
+    """Number of the last completed job from the counter file, or None"""
     try:
         if os.path.exists(COUNTER_FILE):
             with open(COUNTER_FILE, 'r') as f:
-                number = int(f.read().strip())
-            filename = f"{number}.png"
-            content_filename = f"{number}.txt"
-            filepath = os.path.join(QR_OUTPUT_DIR, filename)
-            content_filepath = os.path.join(PRINT_CONTENT_DIR, content_filename)
-            if os.path.exists(filepath):
-                return filename, filepath, content_filename, content_filepath
+                return int(f.read().strip())
     except Exception as e:
         print(f"Error getting latest QR: {e}")
-    return None, None, None, None
+    return None
 
 
-@app.route('/')
-def index():
-    """Main page that displays the print content"""
-    html = """
+def job_info(number, job=None):
+    """
+    Describe a job the way /api/latest reports it - symbols lists every QR
+    code of a split job. Answered from its job index row (looked up unless
+    given), for jobs from before the index from its files.
+    """
+    if job is None:
+        job = job_index.get(number)
+    if job is not None:
+        symbols = symbol_filenames(number, job['symbols'], job['formats'][0]) if job['status'] == DONE else []
+    else:
+        symbols = qr_storage.find_symbols(number, QR_FORMATS)
+    if not symbols:
+        return {'exists': False}
+    info = {
+        'exists': True,
+        'filename': symbols[0],
+        'content_filename': f"{number}.txt",
+        'file_number': number
+    }
+    if len(symbols) > 1:
+        info['symbols'] = symbols
+    return info
+
+
+def latest_job_info():
+    """Describe the latest job the way /api/latest reports it"""
+    job = job_index.latest()
+    if job is not None:
+        return job_info(job['job_id'], job)
+    number = latest_job_number()
+    return job_info(number) if number is not None else {'exists': False}
+
+
+def inline_job_info(info, content=None):
+    """info plus the job's text and QR image as a data URI (all of them in qr_data_uris for a split job), so a screen needs no further requests"""
+    if not info['exists']:
+        return info
+    if content is None:
+        content = content_storage.read_text(info['content_filename'])
+    uris = []
+    for filename in info.get('symbols', [info['filename']]):
+        image = qr_storage.read_bytes(filename)
+        if content is None or image is None:
+            return info
+        uris.append(qr_data_uri(image, os.path.splitext(filename)[1].lstrip('.')))
+    if len(uris) > 1:
+        return dict(info, content=content, qr_data_uri=uris[0], qr_data_uris=uris)
+    return dict(info, content=content, qr_data_uri=uris[0])
+
+
+def wants_inline():
+    """?inline=1 asks /api/latest for the content and QR image too"""
+    return request.args.get('inline', '').lower() in ('1', 'true', 'yes')
+
+
+class LatestJobCache:
+    """Keeps the latest job in memory so screens are answered without touching the disk"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.info = {'exists': False}
+        self.inline = self.info
+        self.content_filename = None
+        self.content = None
+
+    def refresh(self):
+        """Reload the latest job from disk and announce it if it changed"""
+        with self._lock:
+            info = latest_job_info()
+            content = None
+            inline = info
+            if info['exists']:
+                if info == self.info and self.content is not None:
+                    return
+                try:
+                    content = content_storage.read_text(info['content_filename'])
+                    inline = inline_job_info(info, content)
+                except OSError:
+                    content = None
+            self.content_filename = info.get('content_filename') if content is not None else None
+            self.content = content
+            self.info = info
+            self.inline = inline
+        # Screens get everything they need to show the job in the event itself
+        if inline != job_events.latest:
+            job_events.publish(inline)
+
+    def get_content(self, filename):
+        """Cached content for filename, or None if it is not the latest job"""
+        content = self.content
+        if content is not None and filename == self.content_filename:
+            return content
+        return None
+
+
+latest_job = LatestJobCache()
+
+
+class LatestJobEventHandler(FileSystemEventHandler):
+    """Refresh the cache when counter.txt or a QR code file changes"""
+
+    def on_any_event(self, event):
+        # Compaction removing old QR codes and writing segments never brings a new job
+        if event.is_directory or event.event_type == 'deleted':
+            return
+        paths = [event.src_path, getattr(event, 'dest_path', '')]
+        for path in paths:
+            if not path:
+                continue
+            path = os.path.abspath(path)
+            if path.startswith(os.path.abspath(os.path.join(QR_OUTPUT_DIR, ARCHIVE_DIR)) + os.sep):
+                continue
+            if path == os.path.abspath(COUNTER_FILE) or \
+                    path.startswith(os.path.abspath(QR_OUTPUT_DIR) + os.sep):
+                latest_job.refresh()
+                return
+
+
+_watcher_pid = None
+_watcher_lock = threading.Lock()
+
+
+def start_latest_job_watcher():
+    """Load the latest job and keep it up to date from filesystem events - once per process"""
+    global _watcher_pid
+    with _watcher_lock:
+        if _watcher_pid == os.getpid():
+            return
+        latest_job.refresh()
+        event_handler = LatestJobEventHandler()
+        observer = Observer()
+        observer.schedule(event_handler, os.path.dirname(os.path.abspath(COUNTER_FILE)), recursive=False)
+        observer.schedule(event_handler, QR_OUTPUT_DIR, recursive=True)
+        observer.start()
+        _watcher_pid = os.getpid()
+
+
+@app.before_request
+def ensure_latest_job_watcher():
+    """Start the watcher in every process that serves requests, also when a WSGI server imports the app"""
+    if _watcher_pid != os.getpid():
+        start_latest_job_watcher()
+
+
+# The page is the same for every screen - it is built and compressed once, at import
+INDEX_HTML = """
     <!DOCTYPE html>
     <html lang="he" dir="rtl">
     <head>
@@ -171,81 +343,60 @@ def index():
         <script>
             let countdownTimer = null;
             let displayTimer = null;
+            let symbolTimer = null;
+            const SYMBOL_INTERVAL = 1500;  // ms each QR code of a sequence is shown
             let currentPrintNumber = null;
             
             function updateDisplay() {
+                // Polls only need the job number - a new job's content and QR image are fetched once it changes
                 fetch('/api/latest')
                     .then(response => response.json())
-                    .then(data => {
-                        const container = document.getElementById('container');
-                        const printDisplay = document.getElementById('print-display');
-                        const qrContainer = document.getElementById('qr-container');
-                        const qrImage = document.getElementById('qr-image');
-                        const printNumber = document.getElementById('print-number');
-                        const status = document.getElementById('status');
-                        const countdown = document.getElementById('countdown');
+                    .then(showLatest)
+                    .catch(error => {
+                        console.error('Error fetching print data:', error);
+                    });
+            }
+            
+            function showLatest(data) {
+                const printDisplay = document.getElementById('print-display');
+                const qrContainer = document.getElementById('qr-container');
+                const printNumber = document.getElementById('print-number');
+                const status = document.getElementById('status');
+                const countdown = document.getElementById('countdown');
+                
+                if (data.exists && data.filename && data.content_filename) {
+                    // New print detected
+                    if (currentPrintNumber !== data.file_number) {
+                        currentPrintNumber = data.file_number;
                         
-                        if (data.exists && data.filename && data.content_filename) {
-                            // New print detected
-                            if (currentPrintNumber !== data.file_number) {
-                                currentPrintNumber = data.file_number;
-                                
-                                // Fetch and display print content
-                                fetch(`/print_content/${data.content_filename}`)
-                                    .then(response => response.json())
-                                    .then(contentData => {
-                                        // Display the print content
-                                        printDisplay.textContent = contentData.content;
-                                        printDisplay.style.display = 'block';
-                                        
-                                        // Show QR code
-                                        qrImage.src = `/qr/${data.filename}?t=${Date.now()}`;
-                                        qrContainer.style.display = 'flex';
-                                        
-                                        // Update header
-                                        printNumber.textContent = `הדפסה #${data.file_number}`;
-                                        status.textContent = `Print Job #${data.file_number}`;
-                                        
-                                        container.classList.remove('hidden');
-                                        
-                                        // Clear any existing timers
-                                        if (countdownTimer) clearInterval(countdownTimer);
-                                        if (displayTimer) clearTimeout(displayTimer);
-                                        
-                                        // Start countdown
-                                        let seconds = 10;
-                                        countdown.textContent = `מוצג למשך ${seconds} שניות... Displaying for ${seconds} seconds...`;
-                                        
-                                        countdownTimer = setInterval(() => {
-                                            seconds--;
-                                            if (seconds > 0) {
-                                                countdown.textContent = `מוצג למשך ${seconds} שניות... Displaying for ${seconds} seconds...`;
-                                            } else {
-                                                countdown.textContent = '';
-                                                clearInterval(countdownTimer);
-                                            }
-                                        }, 1000);
-                                        
-                                        // Hide after 10 seconds
-                                        displayTimer = setTimeout(() => {
-                                            container.classList.add('hidden');
-                                            status.textContent = 'הדפסה הוסתרה. ממתין להדפסה הבאה... Print hidden. Waiting for next print job...';
-                                            countdown.textContent = '';
-                                        }, 10000);
-                                    })
-                                    .catch(error => {
-                                        console.error('Error fetching print content:', error);
-                                    });
-                            }
+                        if (typeof data.content === 'string' && data.qr_data_uri) {
+                            // Content and QR code came inline - nothing more to fetch
+                            showJob(data, data.content, data.qr_data_uris || [data.qr_data_uri]);
+                        } else {
+                            fetchJob(data);
+                        }
+                    }
+                } else {
+                    // No print available
+                    if (!currentPrintNumber) {
+                        printDisplay.innerHTML = '<div class="no-print">אין הדפסה זמינה. ממתין להדפסה...<br>No print available yet. Waiting for print job...</div>';
+                        qrContainer.style.display = 'none';
+                        printNumber.textContent = '';
+                        status.textContent = '';
+                        countdown.textContent = '';
+                    }
+                }
+            }
+            
+            function fetchJob(data) {
+                // inline=1 brings the content and QR image along in one request
+                fetch('/api/latest?inline=1')
+                    .then(response => response.json())
+                    .then(full => {
+                        if (full.file_number === data.file_number && typeof full.content === 'string' && full.qr_data_uri) {
+                            showJob(full, full.content, full.qr_data_uris || [full.qr_data_uri]);
                         } else {
-                            // No print available
-                            if (!currentPrintNumber) {
-                                printDisplay.innerHTML = '<div class="no-print">אין הדפסה זמינה. ממתין להדפסה...<br>No print available yet. Waiting for print job...</div>';
-                                qrContainer.style.display = 'none';
-                                printNumber.textContent = '';
-                                status.textContent = '';
-                                countdown.textContent = '';
-                            }
+                            fetchJobFiles(data);
                         }
                     })
                     .catch(error => {
@@ -253,8 +404,111 @@ def index():
                     });
             }
             
-            // Check for updates every 500ms
-            setInterval(updateDisplay, 500);
+            function fetchJobFiles(data) {
+                // Fetch and display print content
+                fetch(`/print_content/${data.content_filename}`)
+                    .then(response => response.json())
+                    .then(contentData => showJob(data, contentData.content, (data.symbols || [data.filename]).map(name => `/qr/${name}`)))
+                    .catch(error => {
+                        console.error('Error fetching print content:', error);
+                    });
+            }
+            
+            function showJob(data, content, qrSrcs) {
+                const container = document.getElementById('container');
+                const printDisplay = document.getElementById('print-display');
+                const qrContainer = document.getElementById('qr-container');
+                const qrImage = document.getElementById('qr-image');
+                const printNumber = document.getElementById('print-number');
+                const status = document.getElementById('status');
+                const countdown = document.getElementById('countdown');
+                
+                // Display the print content
+                printDisplay.textContent = content;
+                printDisplay.style.display = 'block';
+                
+                // Show QR code - job images never change, so the browser cache is safe
+                qrImage.src = qrSrcs[0];
+                qrContainer.style.display = 'flex';
+                
+                // Update header
+                printNumber.textContent = `הדפסה #${data.file_number}`;
+                status.textContent = `Print Job #${data.file_number}`;
+
+                // Content split over several QR codes is shown one code at a time, in a loop
+                if (symbolTimer) clearInterval(symbolTimer);
+                symbolTimer = null;
+                if (qrSrcs.length > 1) {
+                    qrSrcs.forEach(src => { new Image().src = src; });
+                    let symbol = 0;
+                    status.textContent = `Print Job #${data.file_number} - QR 1/${qrSrcs.length}`;
+                    symbolTimer = setInterval(() => {
+                        symbol = (symbol + 1) % qrSrcs.length;
+                        qrImage.src = qrSrcs[symbol];
+                        status.textContent = `Print Job #${data.file_number} - QR ${symbol + 1}/${qrSrcs.length}`;
+                    }, SYMBOL_INTERVAL);
+                }
+                
+                container.classList.remove('hidden');
+                
+                // Clear any existing timers
+                if (countdownTimer) clearInterval(countdownTimer);
+                if (displayTimer) clearTimeout(displayTimer);
+                
+                // Start countdown
+                // Long enough to show every QR code of a sequence twice
+                const displaySeconds = Math.max(10, Math.ceil(qrSrcs.length * SYMBOL_INTERVAL * 2 / 1000));
+                let seconds = displaySeconds;
+                countdown.textContent = `מוצג למשך ${seconds} שניות... Displaying for ${seconds} seconds...`;
+                
+                countdownTimer = setInterval(() => {
+                    seconds--;
+                    if (seconds > 0) {
+                        countdown.textContent = `מוצג למשך ${seconds} שניות... Displaying for ${seconds} seconds...`;
+                    } else {
+                        countdown.textContent = '';
+                        clearInterval(countdownTimer);
+                    }
+                }, 1000);
+                
+                // Hide when the display time is up
+                displayTimer = setTimeout(() => {
+                    container.classList.add('hidden');
+                    if (symbolTimer) clearInterval(symbolTimer);
+                    status.textContent = 'הדפסה הוסתרה. ממתין להדפסה הבאה... Print hidden. Waiting for next print job...';
+                    countdown.textContent = '';
+                }, displaySeconds * 1000);
+            }
+            
+            // Polling is only a fallback for when the event stream is unavailable
+            let pollTimer = null;
+            
+            function startPolling() {
+                if (!pollTimer) pollTimer = setInterval(updateDisplay, 500);
+            }
+            
+            function stopPolling() {
+                if (pollTimer) clearInterval(pollTimer);
+                pollTimer = null;
+            }
+            
+            function connectEvents() {
+                // The server pushes each new print job as soon as it lands
+                const events = new EventSource('/api/events');
+                events.onopen = stopPolling;
+                events.onmessage = event => showLatest(JSON.parse(event.data));
+                events.onerror = () => {
+                    startPolling();
+                    // Turned away (every stream slot taken) - the browser gives up, so try again later
+                    if (events.readyState === EventSource.CLOSED) setTimeout(connectEvents, 60000);
+                };
+            }
+            
+            if (window.EventSource) {
+                connectEvents();
+            } else {
+                startPolling();
+            }
             
             // Initial load
             updateDisplay();
@@ -262,39 +516,47 @@ def index():
     </body>
     </html>
     """
-    return html
+index_page = StaticPage(INDEX_HTML)
+
+
+@app.route('/')
+def index():
+    """Main page that displays the print content"""
+    return index_page.response()
 
 
 @app.route('/api/latest', methods=['GET'])
 def api_latest():
-    """API endpoint to get latest QR code info"""
-    filename, filepath, content_filename, content_filepath = get_latest_qr_filename()
-    if filename and filepath:
-        try:
-            number = int(filename.replace('.png', ''))
-            return jsonify({
-                'exists': True,
-                'filename': filename,
-                'content_filename': content_filename,
-                'file_number': number
-            }), 200
-        except:
-            pass
-    return jsonify({'exists': False}), 200
+    """API endpoint to get latest QR code info - ?inline=1 adds the content and QR image"""
+    return jsonify(latest_job.inline if wants_inline() else latest_job.info), 200
+
+
+@app.route('/api/events', methods=['GET'])
+def api_events():
+    """Server-Sent Events stream announcing each new print job - 503 once every screen slot is taken"""
+    if not job_events.has_room():
+        return event_stream_full_response()
+    return Response(stream_with_context(job_events.stream()),
+                    mimetype='text/event-stream',
+                    headers=event_stream_headers())
 
 
 @app.route('/print_content/<filename>', methods=['GET'])
 def get_print_content(filename):
     """Get the print content text file"""
+    content = latest_job.get_content(filename)
+    if content is not None:
+        return job_json_response({
+            'content': content,
+            'filename': filename
+        })
     try:
-        filepath = os.path.join(PRINT_CONTENT_DIR, filename)
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            return jsonify({
+        content = content_storage.read_text(filename)
+        if content is not None:
+            return job_json_response({
                 'content': content,
                 'filename': filename
-            }), 200
+            })
         return jsonify({'error': 'Content file not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -302,18 +564,33 @@ def get_print_content(filename):
 
 @app.route('/qr/<filename>', methods=['GET'])
 def serve_qr(filename):
-    """Serve QR code image files"""
-    filepath = os.path.join(QR_OUTPUT_DIR, filename)
-    if os.path.exists(filepath):
-        return send_file(filepath, mimetype='image/png')
+    """Serve QR code image files (PNG or SVG)"""
+    mimetype = QR_MIMETYPES.get(os.path.splitext(filename)[1].lstrip('.').lower())
+    filepath = qr_storage.find(filename) if mimetype else None
+    if filepath:
+        return send_job_file(filepath, mimetype)
+    content = qr_storage.read_archived(filename) if mimetype else None
+    if content is not None:
+        return send_job_bytes(content, mimetype)
     return jsonify({'error': 'QR code not found'}), 404
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Request counts and latency of the display routes in the Prometheus text format"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="QR display server")
+    add_server_arguments(parser, port=8080, screens=True)
+    args = parser.parse_args()
+    
     print("=" * 50)
     print("QR Display Server Starting...")
-    print("Display server running on http://localhost:8080")
+    print(f"Display server running on http://localhost:{args.port}")
     print("QR codes will be shown for 10 seconds then disappear")
     print("=" * 50)
-    app.run(host='0.0.0.0', port=8080, debug=True)
+    job_events.max_subscribers = args.screens
+    serve(app, **vars(args))
 
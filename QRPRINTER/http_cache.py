@@ -0,0 +1,41 @@
+"""
+HTTP Cache - Validators and long-lived caching for job files, which never change once written
+
+Job numbers are never reused, so N.png and N.txt can be cached by browsers
+and proxies for a year. Repeat requests carrying the ETag get a bodiless 304.
+"""
+import os
+import hashlib
+from flask import Response, request, send_file, jsonify
+
+# A year - the longest max-age caches are expected to honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def cache_forever(response):
+    """Mark a job file response public and immutable for IMMUTABLE_MAX_AGE"""
+    response.cache_control.public = True
+    response.cache_control.max_age = IMMUTABLE_MAX_AGE
+    response.cache_control.immutable = True
+    return response
+
+
+def send_job_file(filepath, mimetype):
+    """Send a job file with an ETag, answering a matching If-None-Match with 304"""
+    response = send_file(os.path.abspath(filepath), mimetype=mimetype, etag=True, conditional=True,
+                         max_age=IMMUTABLE_MAX_AGE)
+    return cache_forever(response)
+
+
+def send_job_bytes(content, mimetype):
+    """Send a job file read from its archive segment, with an ETag of its content and 304 handling"""
+    response = Response(content, mimetype=mimetype)
+    response.set_etag(hashlib.sha1(content).hexdigest())
+    return cache_forever(response).make_conditional(request)
+
+
+def job_json_response(payload):
+    """JSON describing a job file, with an ETag of its body and 304 handling"""
+    response = jsonify(payload)
+    response.add_etag()
+    return cache_forever(response).make_conditional(request)
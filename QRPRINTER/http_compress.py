@@ -0,0 +1,83 @@
+"""
+HTTP Compress - Precompressed static pages and gzip for large JSON responses
+
+The display page is the same for every screen, so it is encoded once at
+startup (gzip, and brotli when the brotli package is installed) and each
+load just picks a variant. JSON bodies above COMPRESS_MIN_BYTES are gzipped
+per response. Responses that vary by encoding say so with Vary: Accept-Encoding.
+"""
+import gzip
+import hashlib
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies smaller than this fit in a packet or two - compressing them is not worth the CPU
+COMPRESS_MIN_BYTES = 1024
+# gzip level for per-response compression (static pages always use the best)
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/plain', 'image/svg+xml'}
+
+
+def accepted_encoding(available):
+    """The best encoding in available the client accepts, 'identity' if none"""
+    best = request.accept_encodings.best_match([e for e in available if e != 'identity'])
+    return best or 'identity'
+
+
+class StaticPage:
+    """A page built once, kept in memory precompressed and served with an ETag"""
+
+    def __init__(self, body, mimetype='text/html'):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+
+    def response(self):
+        """The best variant for this request, 304 when the client already has it"""
+        encoding = accepted_encoding(('br', 'gzip'))
+        if encoding not in self.variants:
+            encoding = 'gzip' if encoding == 'br' else 'identity'
+        response = Response(self.variants[encoding], mimetype=self.mimetype)
+        if encoding == 'identity':
+            response.set_etag(self.etag)
+        else:
+            response.set_etag(f"{self.etag}-{encoding}")
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        # Revalidate on every load so a new deployment shows up - unchanged pages cost a 304
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+def compress_response(response):
+    """after_request hook gzipping large compressible bodies for clients that accept it"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    if response.content_length is not None and response.content_length < COMPRESS_MIN_BYTES:
+        return response
+    response.vary.add('Accept-Encoding')
+    if accepted_encoding(('gzip',)) != 'gzip':
+        return response
+    response.set_data(gzip.compress(response.get_data(), COMPRESS_LEVEL, mtime=0))
+    response.headers['Content-Encoding'] = 'gzip'
+    # Same representation, different bytes - a weak validator still matches If-None-Match
+    etag, _ = response.get_etag()
+    if etag:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def compress_app(app):
+    """Gzip large JSON and text responses of every route of app"""
+    app.after_request(compress_response)
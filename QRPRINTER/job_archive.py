@@ -0,0 +1,244 @@
+"""
+Job Archive - Rolls old job files into per-day zip segments that stay readable
+
+Files that have not changed for ARCHIVE_AFTER_DAYS are packed into
+<root>/archive/<YYYY-MM-DD>.zip, one segment per day they were written, and
+removed from the directory. An SQLite index (archive/index.db) maps each file
+name to its segment, so JobStorage keeps serving archived files. Segments are
+never rewritten - files of a day that was already compacted go into a new
+<YYYY-MM-DD>-2.zip - and are deleted whole once past RETENTION_DAYS.
+
+    python job_archive.py compact qr_codes print_content print_archive
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import zipfile
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from job_sequence import FileLock
+
+# Subdirectory of a storage root holding its segments and index
+ARCHIVE_DIR = "archive"
+INDEX_FILENAME = "index.db"
+# Files older than this many days are archived - newer ones stay plain files
+ARCHIVE_AFTER_DAYS = 7
+# Archived files are deleted after this many days - None keeps them forever
+RETENTION_DAYS = None
+# Seconds between compaction runs
+COMPACT_INTERVAL = 3600
+# Already compressed - deflating them again only costs CPU
+STORED_EXTENSIONS = ('.png', '.zip', '.gz')
+# Segments each process keeps open for reads
+OPEN_SEGMENTS = 8
+
+SEGMENT_NAME = re.compile(r'^(\d{4}-\d{2}-\d{2})(?:-\d+)?\.zip$')
+
+
+class JobArchive:
+    """Per-day zip segments of the old files of one directory, and the index to find them"""
+
+    def __init__(self, root):
+        self.root = root
+        self.directory = os.path.join(root, ARCHIVE_DIR)
+        self.index_path = os.path.join(self.directory, INDEX_FILENAME)
+        self._local = threading.local()
+        self._segments = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.index_path, timeout=30)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS files (name TEXT PRIMARY KEY, segment TEXT NOT NULL)')
+        connection.execute('CREATE INDEX IF NOT EXISTS files_by_segment ON files (segment)')
+        return connection
+
+    def segment_of(self, name):
+        """Segment holding name, or None if it was never archived"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # Nothing archived yet - do not create the index just to look in it
+            if not os.path.exists(self.index_path):
+                return None
+            connection = self._local.connection = self._connect()
+        row = connection.execute('SELECT segment FROM files WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _open_segment(self, segment):
+        with self._lock:
+            archive = self._segments.pop(segment, None)
+            if archive is None:
+                archive = zipfile.ZipFile(os.path.join(self.directory, segment))
+            self._segments[segment] = archive
+            # Dropped segments are closed once no reader holds them any more
+            while len(self._segments) > OPEN_SEGMENTS:
+                self._segments.popitem(last=False)
+            return archive
+
+    def read(self, name):
+        """Content of an archived file, or None if it is not in the archive"""
+        segment = self.segment_of(name)
+        if segment is None:
+            return None
+        try:
+            return self._open_segment(segment).read(name)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            # Segment expired since the lookup
+            return None
+
+    def _old_files(self, before):
+        """Files of the directory last written before the day before, by day"""
+        days = {}
+        for directory, subdirectories, filenames in os.walk(self.root):
+            if directory == self.root and ARCHIVE_DIR in subdirectories:
+                subdirectories.remove(ARCHIVE_DIR)
+            for name in filenames:
+                # Uploads and atomic writes in progress
+                if name.startswith('.') or name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    mtime = os.stat(path).st_mtime
+                except OSError:
+                    continue
+                day = date.fromtimestamp(mtime)
+                if day < before:
+                    days.setdefault(day, []).append((path, name, mtime))
+        return days
+
+    def _new_segment(self, day):
+        segment = f"{day.isoformat()}.zip"
+        number = 1
+        while os.path.exists(os.path.join(self.directory, segment)):
+            number += 1
+            segment = f"{day.isoformat()}-{number}.zip"
+        return segment
+
+    def _archive_day(self, connection, day, files):
+        """Pack files into a new segment of day, index them, then remove them - returns how many"""
+        segment = self._new_segment(day)
+        tmp_path = os.path.join(self.directory, f".{segment}.tmp")
+        archived = []
+        names = set()
+        with zipfile.ZipFile(tmp_path, 'w') as archive:
+            for path, name, mtime in sorted(files, key=lambda file: file[2]):
+                # A file left both in the flat layout and a shard - keep the first, leave the other
+                if name in names:
+                    continue
+                try:
+                    with open(path, 'rb') as f:
+                        content = f.read()
+                except OSError:
+                    continue
+                info = zipfile.ZipInfo(name, time.localtime(mtime)[:6])
+                stored = os.path.splitext(name)[1].lower() in STORED_EXTENSIONS
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                archive.writestr(info, content)
+                names.add(name)
+                archived.append(path)
+        if not archived:
+            os.remove(tmp_path)
+            return 0
+        os.replace(tmp_path, os.path.join(self.directory, segment))
+
+        # Indexed before the plain files go, so every file can be found at any moment
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO files (name, segment) VALUES (?, ?)',
+                                   [(name, segment) for name in names])
+        for path in archived:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return len(archived)
+
+    def _expire(self, connection, before):
+        """Delete the segments of days before before, returns how many"""
+        removed = 0
+        for segment in sorted(os.listdir(self.directory)):
+            match = SEGMENT_NAME.match(segment)
+            if not match or date.fromisoformat(match.group(1)) >= before:
+                continue
+            with connection:
+                connection.execute('DELETE FROM files WHERE segment = ?', (segment,))
+            with self._lock:
+                self._segments.pop(segment, None)
+            try:
+                os.remove(os.path.join(self.directory, segment))
+                removed += 1
+            except OSError:
+                pass  # Still open in another process (Windows) - retried on the next run
+        return removed
+
+    def compact(self, archive_after_days=ARCHIVE_AFTER_DAYS, retention_days=RETENTION_DAYS, today=None):
+        """
+        Archive the files older than archive_after_days and delete the segments
+        older than retention_days (None keeps them). Processes sharing the
+        directory take turns. Returns (files archived, segments deleted).
+        """
+        today = today or date.today()
+        os.makedirs(self.directory, exist_ok=True)
+        with FileLock(os.path.join(self.directory, ".compact.lock")):
+            connection = self._connect()
+            try:
+                archived = 0
+                for day, files in sorted(self._old_files(today - timedelta(days=archive_after_days)).items()):
+                    archived += self._archive_day(connection, day, files)
+                removed = 0
+                if retention_days is not None:
+                    removed = self._expire(connection, today - timedelta(days=retention_days))
+            finally:
+                connection.close()
+        return archived, removed
+
+
+class Compactor:
+    """Background thread compacting some archives every interval seconds"""
+
+    def __init__(self, archives, interval=COMPACT_INTERVAL, archive_after_days=ARCHIVE_AFTER_DAYS,
+                 retention_days=RETENTION_DAYS):
+        self.archives = archives
+        self.interval = interval
+        self.archive_after_days = archive_after_days
+        self.retention_days = retention_days
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Compact every archive now"""
+        for archive in self.archives:
+            try:
+                archived, removed = archive.compact(self.archive_after_days, self.retention_days)
+            except Exception as e:
+                print(f"[{datetime.now()}] ✗ Compacting {os.path.abspath(archive.root)} failed: {e}")
+                continue
+            if archived or removed:
+                print(f"[{datetime.now()}] Compacted {os.path.abspath(archive.root)} - "
+                      f"{archived} files archived, {removed} expired segments deleted")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="job-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'compact':
+        print("Usage: python job_archive.py compact <directory> [<directory> ...]")
+        sys.exit(1)
+    for directory in sys.argv[2:]:
+        print(f"Compacting {os.path.abspath(directory)}...")
+        archived, removed = JobArchive(directory).compact()
+        print(f"  ✓ Archived {archived} files, deleted {removed} expired segments")
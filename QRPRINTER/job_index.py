@@ -0,0 +1,156 @@
+"""
+Job Index - SQLite table of every print job, so lookups never probe job files
+
+One row per job number: its render status, when it was submitted and
+completed, the SHA-256 and size of its content, how many QR symbols it has,
+the formats they were written in and their QR version. The database runs in
+WAL mode, so the display and other printer processes read it while a printer
+writes, and every lookup is a primary-key or index query whatever the number
+of job files.
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+JOB_INDEX_FILE = "jobs.db"
+QUEUED, DONE, FAILED = 'queued', 'done', 'failed'
+# Jobs per page of /jobs, by default and at most
+DEFAULT_PAGE = 100
+MAX_PAGE = 1000
+# Seconds between looks at a job another process is rendering, while waiting for it
+POLL_INTERVAL = 0.1
+# Jobs still queued after this many seconds were lost with a printer process that stopped - see fail_stale()
+STALE_AFTER = 600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    number INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    submitted_at REAL NOT NULL,
+    completed_at REAL,
+    content_sha256 TEXT NOT NULL,
+    content_bytes INTEGER NOT NULL,
+    symbols INTEGER NOT NULL,
+    formats TEXT NOT NULL,
+    qr_version INTEGER,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_completion ON jobs (status, completed_at);
+"""
+COLUMNS = ('number', 'status', 'submitted_at', 'completed_at', 'content_sha256', 'content_bytes',
+           'symbols', 'formats', 'qr_version', 'error')
+
+
+def _job(row):
+    """A row as the job dict endpoints report - job_id, formats as a list, error only when set"""
+    job = dict(zip(COLUMNS, row))
+    job['job_id'] = job.pop('number')
+    job['formats'] = job['formats'].split(',')
+    if job['error'] is None:
+        del job['error']
+    return job
+
+
+class JobIndex:
+    """
+    The job table in path. A writer creates it; with create=False (the
+    display) lookups find nothing until a printer has created it.
+    """
+
+    def __init__(self, path=JOB_INDEX_FILE, create=True):
+        self.path = path
+        self._local = threading.local()
+        if create:
+            connection = sqlite3.connect(path, timeout=30)
+            try:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.executescript(SCHEMA)
+            finally:
+                connection.close()
+
+    def _connection(self):
+        """This thread's connection, or None if there is no index yet - never shared with a forked child"""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            if not os.path.exists(self.path):
+                return None
+            local.connection = sqlite3.connect(self.path, timeout=30)
+            # WAL stays consistent without an fsync per commit - a power cut may lose the last jobs
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            local.pid = os.getpid()
+        return local.connection
+
+    @staticmethod
+    def _row(number, content, symbols, formats, status, qr_version, error):
+        encoded = content.encode('utf-8')
+        now = time.time()
+        return (number, status, now, None if status == QUEUED else now, hashlib.sha256(encoded).hexdigest(),
+                len(encoded), symbols, ','.join(formats), qr_version, error)
+
+    def add(self, number, content, symbols=1, formats=('png',), status=QUEUED, qr_version=None, error=None):
+        """Record a job - queued until complete() is called, or already finished with status"""
+        self.add_many([(number, content, symbols, formats, status, qr_version, error)])
+
+    def add_many(self, jobs):
+        """Record many jobs in one transaction - tuples of add()'s arguments, all of them given"""
+        connection = self._connection()
+        with connection:
+            connection.executemany(f"INSERT OR REPLACE INTO jobs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                                   [self._row(*job) for job in jobs])
+
+    def complete(self, number, qr_version=None, error=None):
+        """Mark a queued job done, or failed with error"""
+        connection = self._connection()
+        with connection:
+            connection.execute('UPDATE jobs SET status = ?, completed_at = ?, qr_version = ?, error = ? WHERE number = ?',
+                               (FAILED if error else DONE, time.time(), qr_version, error, number))
+
+    def get(self, number, wait=0):
+        """A job, or None - waits up to wait seconds while it is queued, also in another process"""
+        connection = self._connection()
+        if connection is None:
+            return None
+        # Written so a NaN wait does not wait at all, rather than forever
+        deadline = time.monotonic() + (wait if wait > 0 else 0)
+        while True:
+            row = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE number = ?", (number,)).fetchone()
+            if row is None or row[1] != QUEUED or time.monotonic() >= deadline:
+                return _job(row) if row else None
+            time.sleep(POLL_INTERVAL)
+
+    def fail_stale(self, older_than=STALE_AFTER):
+        """
+        Mark jobs queued for more than older_than seconds failed, returns how
+        many - a printer process that stopped mid-render leaves them queued
+        for good. Other printer processes share the index, so newer queued
+        jobs may still be rendering; a stale job that does finish is marked
+        done by complete() as usual.
+        """
+        connection = self._connection()
+        now = time.time()
+        with connection:
+            cursor = connection.execute('UPDATE jobs SET status = ?, completed_at = ?, error = ? '
+                                        'WHERE status = ? AND submitted_at < ?',
+                                        (FAILED, now, 'Printer stopped before the job was rendered', QUEUED,
+                                         now - older_than))
+        return cursor.rowcount
+
+    def latest(self):
+        """The job that completed last, or None"""
+        connection = self._connection()
+        if connection is None:
+            return None
+        row = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE status = ? "
+                                 "ORDER BY completed_at DESC, number DESC LIMIT 1", (DONE,)).fetchone()
+        return _job(row) if row else None
+
+    def since(self, number, limit=DEFAULT_PAGE):
+        """Up to limit jobs numbered above number, lowest first"""
+        connection = self._connection()
+        if connection is None:
+            return []
+        rows = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM jobs WHERE number > ? ORDER BY number LIMIT ?",
+                                  (number, limit))
+        return [_job(row) for row in rows]
@@ -0,0 +1,140 @@
+"""
+Job Sequence - Hands out print job numbers from memory, reserving them in durable blocks
+"""
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# File holding the highest job number reserved by any process
+SEQUENCE_FILE = "sequence.txt"
+# How many numbers a process reserves at once
+BLOCK_SIZE = 1000
+
+
+def _read_number(path):
+    """Read an integer from a file, 0 if missing or unreadable"""
+    try:
+        with open(path, 'r') as f:
+            return int(f.read().strip() or 0)
+    except (ValueError, OSError):
+        return 0
+
+
+def _fsync_directory(path):
+    """Flush the directory entry of path, so a rename survives a power loss (POSIX only)"""
+    if os.name != 'posix':
+        # Windows cannot open directories - NTFS journals the rename itself
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_number_atomic(path, number, sync=False):
+    """
+    Replace the file content with a number so readers never see a partial
+    write. With sync, the number and the rename are on disk on return.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(str(number))
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if sync:
+        _fsync_directory(path)
+
+
+class FileLock:
+    """Exclusive lock on a lock file, shared by every process using the data directory"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a+b')
+        if fcntl:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        else:
+            self._file.seek(0)
+            # LK_LOCK retries for about 10 seconds before raising
+            while True:
+                try:
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if fcntl:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+            else:
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self._file.close()
+            self._file = None
+
+
+class JobSequence:
+    """
+    Thread-safe job number allocator.
+
+    Numbers are handed out from an in-memory block. Only when a block runs out
+    does the process take the shared file lock, bump the high-water mark in
+    SEQUENCE_FILE by block_size and fsync it. A crash therefore skips the rest
+    of the block instead of reusing numbers, and processes sharing the data
+    directory each get their own blocks.
+    """
+
+    def __init__(self, sequence_file=SEQUENCE_FILE, legacy_counter_file=None, block_size=BLOCK_SIZE):
+        self.sequence_file = sequence_file
+        self.legacy_counter_file = legacy_counter_file
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 1
+        self._limit = 0  # Last number of the current block
+        self._pid = os.getpid()
+
+    def _reserve_block(self, count):
+        """Durably reserve count numbers, return the first one"""
+        with FileLock(self.sequence_file + ".lock"):
+            high_water = _read_number(self.sequence_file)
+            if self.legacy_counter_file:
+                # Never hand out numbers already used before the allocator existed
+                high_water = max(high_water, _read_number(self.legacy_counter_file))
+            write_number_atomic(self.sequence_file, high_water + count, sync=True)
+        return high_water + 1
+
+    def next(self):
+        """Get the next job number"""
+        return self.reserve(1)[0]
+
+    def reserve(self, count):
+        """Reserve count contiguous job numbers, returns a range"""
+        if count < 1:
+            raise ValueError("count must be at least 1")
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker process - the parent may still use its block
+                self._pid = os.getpid()
+                self._next, self._limit = 1, 0
+            if self._next + count - 1 > self._limit:
+                # Not enough left in this block - the remainder is skipped
+                size = max(count, self.block_size)
+                self._next = self._reserve_block(size)
+                self._limit = self._next + size - 1
+            first = self._next
+            self._next += count
+        return range(first, first + count)
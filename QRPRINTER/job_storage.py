@@ -0,0 +1,187 @@
+"""
+Job Storage - Keeps per-job files in sharded directories so lookups stay flat as jobs grow
+
+Job N is stored as <root>/<N // 1000000>/<N // 1000 % 1000>/<N>.<ext>, so no
+directory holds more than 1000 job files. Files written before sharding are
+still found in the flat <root>/<N>.<ext> layout until they are migrated:
+
+    python job_storage.py migrate qr_codes print_content
+
+Content split over several QR codes is stored as N-1.<ext> ... N-k.<ext>,
+listed in the job's manifest N.json. Files rolled into <root>/archive by
+job_archive.py are read back from their segment.
+"""
+import io
+import os
+import re
+import json
+import sys
+import threading
+from job_archive import JobArchive
+
+# Job files are named <number>.<extension>, or <number>-<symbol>.<extension> for the
+# QR codes of content split over several symbols (structured append)
+JOB_FILENAME = re.compile(r'^(\d+)(?:-(\d+))?\.([A-Za-z0-9]+)$')
+
+
+def job_number(filename):
+    """Job number of a job filename, or None if it is not one"""
+    match = JOB_FILENAME.match(filename)
+    return int(match.group(1)) if match else None
+
+
+def symbol_filenames(number, count, ext):
+    """QR code filenames of a job with count symbols - N.ext, or N-1.ext ... N-k.ext"""
+    if count == 1:
+        return [f"{number}.{ext}"]
+    return [f"{number}-{position}.{ext}" for position in range(1, count + 1)]
+
+
+def manifest_filename(number):
+    """Manifest listing the QR code files of a job split over several symbols"""
+    return f"{number}.json"
+
+
+def shard_dir(number):
+    """Relative shard directory of a job number"""
+    return os.path.join(f"{number // 1000000:03d}", f"{number // 1000 % 1000:03d}")
+
+
+class JobStorage:
+    """Files of one kind (QR codes, print content) for every job, under root"""
+
+    def __init__(self, root, sharded=True):
+        self.root = root
+        self.sharded = sharded
+        self._created = set()
+        self._lock = threading.Lock()
+        self.archive = JobArchive(root)
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, filename):
+        """Where filename is written, or None if it is not a job filename"""
+        number = job_number(filename)
+        if number is None:
+            return None
+        if not self.sharded:
+            return os.path.join(self.root, filename)
+        return os.path.join(self.root, shard_dir(number), filename)
+
+    def find(self, filename):
+        """Path of an existing job file, or None"""
+        path = self.path(filename)
+        if path is None:
+            return None
+        if os.path.exists(path):
+            return path
+        flat_path = os.path.join(self.root, filename)
+        if flat_path != path and os.path.exists(flat_path):
+            return flat_path
+        return None
+
+    def _ensure_dir(self, path):
+        directory = os.path.dirname(path)
+        if directory in self._created:
+            return
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            self._created.add(directory)
+
+    def write_bytes(self, filename, content):
+        """Write a job file, returns its path"""
+        path = self.path(filename)
+        if path is None:
+            raise ValueError(f"Not a job filename: {filename}")
+        self._ensure_dir(path)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def move_in(self, filename, src_path):
+        """Move a finished file (on the same filesystem) into place as a job file, returns its path"""
+        path = self.path(filename)
+        if path is None:
+            raise ValueError(f"Not a job filename: {filename}")
+        self._ensure_dir(path)
+        os.replace(src_path, path)
+        return path
+
+    def write_text(self, filename, text):
+        """Write a UTF-8 job file, returns its path"""
+        return self.write_bytes(filename, text.encode('utf-8'))
+
+    def read_archived(self, filename):
+        """Content of a job file that was archived, or None"""
+        if job_number(filename) is None:
+            return None
+        return self.archive.read(filename)
+
+    def exists(self, filename):
+        """Whether a job file exists, as a plain file or archived"""
+        return self.find(filename) is not None or (
+            job_number(filename) is not None and self.archive.segment_of(filename) is not None)
+
+    def read_bytes(self, filename):
+        """Content of a job file, plain or archived, or None if it does not exist"""
+        path = self.find(filename)
+        if path is not None:
+            try:
+                with open(path, 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass  # Archived since it was found
+        return self.read_archived(filename)
+
+    def read_text(self, filename):
+        """Content of a UTF-8 job file, plain or archived, or None if it does not exist"""
+        content = self.read_bytes(filename)
+        if content is None:
+            return None
+        # Newlines translated as when the file is read in text mode
+        return io.TextIOWrapper(io.BytesIO(content), encoding='utf-8').read()
+
+    def find_symbols(self, number, formats):
+        """
+        QR code filenames of a job in the first of formats it was written in -
+        [N.ext], or N-1.ext ... N-k.ext from its manifest - or [] if none exist
+        """
+        for fmt in formats:
+            filename = f"{number}.{fmt}"
+            if self.exists(filename):
+                return [filename]
+        manifest = self.read_text(manifest_filename(number))
+        if manifest:
+            files = json.loads(manifest)['files']
+            for fmt in formats:
+                if fmt in files:
+                    return files[fmt]
+        return []
+
+
+def migrate_flat_files(root):
+    """Move job files from the flat layout of root into shards, returns how many moved"""
+    storage = JobStorage(root)
+    moved = 0
+    with os.scandir(root) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            path = storage.path(entry.name)
+            if path is None:
+                continue
+            storage._ensure_dir(path)
+            if os.path.exists(path):
+                print(f"  Skipping {entry.name}: already in {path}")
+                continue
+            os.rename(entry.path, path)
+            moved += 1
+    return moved
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] != 'migrate':
+        print("Usage: python job_storage.py migrate <directory> [<directory> ...]")
+        sys.exit(1)
+    for directory in sys.argv[2:]:
+        print(f"Migrating {os.path.abspath(directory)}...")
+        print(f"  ✓ Moved {migrate_flat_files(directory)} files into shards")
@@ -3,77 +3,65 @@ Print File Watcher - Monitors a directory for print files and sends them to the
 """
 import os
 import time
+import threading
 import requests
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
-from datetime import datetime
+from print_ingest import PrintFileHandler, PrintIngestor, SubmitError
+from job_archive import Compactor, JobArchive
 
 # Configuration
 PRINT_INPUT_DIR = "print_input"
 PRINT_ARCHIVE_DIR = "print_archive"
+# Files the printer service could not take yet, with their retry state
+PRINT_PENDING_DIR = "print_pending"
 PRINTER_SERVICE_URL = "http://localhost:5000/print"
+# Seconds between rescans of the input directory for files without an event - None to disable
+RESCAN_INTERVAL = 300
+# Archived print files older than this many days are rolled into per-day zip segments in print_archive/archive/
+ARCHIVE_AFTER_DAYS = 7
+# Days before they are deleted - None keeps them forever
+RETENTION_DAYS = None
 
 # Ensure directories exist
 os.makedirs(PRINT_INPUT_DIR, exist_ok=True)
 os.makedirs(PRINT_ARCHIVE_DIR, exist_ok=True)
 
 
-class PrintFileHandler(FileSystemEventHandler):
-    """Handle new print files"""
-    
-    def on_created(self, event):
-        if not event.is_directory:
-            # Wait a moment for file to be fully written
-            time.sleep(0.5)
-            self.process_file(event.src_path)
-    
-    def process_file(self, filepath):
-        """Process a print file and send to printer service"""
-        try:
-            filename = os.path.basename(filepath)
-            print(f"[{datetime.now()}] Processing print file: {filename}")
-            
-            # Read file content
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            
-            if not content.strip():
-                print(f"  Warning: File is empty, skipping...")
-                return
-            
-            # Send to printer service
-            try:
-                response = requests.post(
-                    PRINTER_SERVICE_URL,
-                    json={'content': content},
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    print(f"  ✓ QR code created: {result['filename']}")
-                    
-                    # Move file to archive
-                    archive_path = os.path.join(PRINT_ARCHIVE_DIR, filename)
-                    if os.path.exists(filepath):
-                        os.rename(filepath, archive_path)
-                        print(f"  ✓ File archived to: {archive_path}")
-                else:
-                    print(f"  ✗ Error: {response.status_code} - {response.text}")
-                    
-            except requests.exceptions.ConnectionError:
-                print(f"  ✗ Error: Could not connect to printer service at {PRINTER_SERVICE_URL}")
-                print(f"    Make sure printer_service.py is running!")
-            except Exception as e:
-                print(f"  ✗ Error sending to printer service: {str(e)}")
-                
-        except Exception as e:
-            print(f"  ✗ Error processing file: {str(e)}")
+# One keep-alive session per ingest worker, so files reuse open connections
+_sessions = threading.local()
+
+
+def get_session():
+    """HTTP session of the calling worker thread"""
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = _sessions.session = requests.Session()
+    return session
+
+
+def submit_print(content):
+    """Send print content to the printer service, returns its JSON result"""
+    try:
+        response = get_session().post(PRINTER_SERVICE_URL, json={'content': content}, timeout=10)
+    except requests.exceptions.ConnectionError:
+        raise SubmitError(f"Could not connect to printer service at {PRINTER_SERVICE_URL}\n"
+                          "    Make sure printer_service.py is running!")
+    # 202 when the service renders in the background (ASYNC_RENDER) - the job is accepted either way
+    if not response.ok:
+        # A 4xx other than timeout/rate limit means this content will never be accepted
+        retryable = not (400 <= response.status_code < 500) or response.status_code in (408, 429)
+        raise SubmitError(f"{response.status_code} - {response.text}", retryable=retryable)
+    return response.json()
 
 
 def start_watcher():
     """Start watching the print input directory"""
-    event_handler = PrintFileHandler()
+    ingestor = PrintIngestor(submit_print, PRINT_ARCHIVE_DIR, PRINT_PENDING_DIR)
+    ingestor.start()
+    compactor = Compactor([JobArchive(PRINT_ARCHIVE_DIR)], archive_after_days=ARCHIVE_AFTER_DAYS,
+                          retention_days=RETENTION_DAYS)
+    compactor.start()
+    event_handler = PrintFileHandler(ingestor, PRINT_INPUT_DIR)
     observer = Observer()
     observer.schedule(event_handler, PRINT_INPUT_DIR, recursive=False)
     observer.start()
@@ -83,16 +71,30 @@ def start_watcher():
     print(f"Watching directory: {os.path.abspath(PRINT_INPUT_DIR)}")
     print(f"Sending to: {PRINTER_SERVICE_URL}")
     print("=" * 60)
+    
+    # Files that arrived while the watcher was not running
+    backlog = ingestor.scan(PRINT_INPUT_DIR)
+    if backlog:
+        print(f"Catching up on {backlog} waiting print files...")
+    if ingestor.spooled():
+        print(f"Retrying {ingestor.spooled()} spooled print files from {os.path.abspath(PRINT_PENDING_DIR)}...")
     print("\nWaiting for print files... (Press Ctrl+C to stop)\n")
     
     try:
+        last_scan = time.monotonic()
         while True:
             time.sleep(1)
+            # Catch files whose events were missed, e.g. on network shares
+            if RESCAN_INTERVAL and time.monotonic() - last_scan >= RESCAN_INTERVAL:
+                ingestor.scan(PRINT_INPUT_DIR)
+                last_scan = time.monotonic()
     except KeyboardInterrupt:
         observer.stop()
         print("\n\nStopping file watcher...")
     
     observer.join()
+    ingestor.stop()
+    compactor.stop()
     print("File watcher stopped.")
 
 
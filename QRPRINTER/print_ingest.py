@@ -0,0 +1,494 @@
+"""
+Print Ingest - Picks up print files once they are completely written and submits them in parallel
+
+A file is ready when the writer closes it or renames it into the watched
+directory, or once its size and modification time have not changed for
+QUIET_PERIOD seconds - on Windows also only once no other process has it open
+any more. Where the platform reports opens and closes (Linux), a
+file that was opened in place waits for its close instead, so a writer may
+pause between writes - or, should no close come, until it has not changed for
+OPEN_FILE_TIMEOUT seconds. Files moved in from another directory and files
+found by a scan are never opened in place, so no close comes for them.
+Ready files go on a queue served by a bounded pool of worker threads, so the
+observer thread never blocks and a burst of files is submitted in parallel.
+
+Files that arrived while nobody was watching are picked up by scan(), oldest
+first, at a limited rate so new files are not held up behind the backlog.
+
+With a spool directory, files the printer service could not take are moved
+there with their attempt count and retried with exponential backoff. The
+first success after an outage makes every spooled file due again, so a
+service restart drains the spool at the pace of the workers. While the spool
+holds more than spool_limit files, new files wait in the input directory.
+"""
+import os
+import json
+import time
+import queue
+import random
+import shutil
+import threading
+from collections import deque
+from datetime import datetime
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+try:
+    from watchdog.observers.inotify import InotifyObserver
+except ImportError:  # Not Linux
+    InotifyObserver = None
+
+if os.name == 'nt':
+    import ctypes
+    from ctypes import wintypes
+
+    _kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    _kernel32.CreateFileW.restype = wintypes.HANDLE
+    _kernel32.CreateFileW.argtypes = (wintypes.LPCWSTR, wintypes.DWORD, wintypes.DWORD, wintypes.LPVOID,
+                                      wintypes.DWORD, wintypes.DWORD, wintypes.HANDLE)
+    _kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+    _INVALID_HANDLE_VALUE = wintypes.HANDLE(-1).value
+else:
+    _kernel32 = None
+
+# Worker threads submitting ready files
+INGEST_WORKERS = 4
+# Seconds between size checks of files still being written
+POLL_INTERVAL = 0.2
+# Seconds a file must stay unchanged to count as written when no close event will tell - raise it for
+# writers that pause longer between writes on macOS, where nothing else shows a file is still open
+QUIET_PERIOD = 1
+# Whether the default observer reports opens and closes (inotify) - then a file opened in place is ready once closed
+CLOSE_EVENTS = InotifyObserver is not None and Observer is InotifyObserver
+# Seconds a file opened in place may stay unchanged without a close before it is taken anyway - readers open files too
+OPEN_FILE_TIMEOUT = 30
+# Seconds an empty file must stay empty before it is processed (and skipped)
+EMPTY_FILE_GRACE = 5
+# Backlog files submitted per second by scan() - None for as fast as the workers go
+BACKLOG_RATE = 50
+# Backlog files modified more recently than this (seconds) may still be written, so they are watched first
+BACKLOG_MIN_AGE = 1
+# Retry delays in seconds - doubled after every failed attempt, up to the maximum
+RETRY_BASE_DELAY = 2
+RETRY_MAX_DELAY = 300
+# Spooled files above which new files are held back until the printer service catches up
+SPOOL_LIMIT = 1000
+
+
+def _held_open(path):
+    """
+    Whether another process still has path open - on Windows, where opening
+    it without sharing fails while any other handle is open. Elsewhere False,
+    the quiet period or the close decides.
+    """
+    if _kernel32 is None:
+        return False
+    handle = _kernel32.CreateFileW(path, 0x80000000, 0, None, 3, 0, None)  # GENERIC_READ, OPEN_EXISTING
+    if handle == _INVALID_HANDLE_VALUE:
+        return ctypes.get_last_error() == 32  # ERROR_SHARING_VIOLATION
+    _kernel32.CloseHandle(handle)
+    return False
+
+
+class SubmitError(Exception):
+    """The printer service did not accept a print file - retryable unless the content itself was refused"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class PrintIngestor:
+    """Tracks files until they are complete, then submits and archives them"""
+
+    def __init__(self, submit, archive_dir, spool_dir=None, workers=INGEST_WORKERS,
+                 poll_interval=POLL_INTERVAL, quiet_period=QUIET_PERIOD, spool_limit=SPOOL_LIMIT,
+                 close_events=CLOSE_EVENTS, open_file_timeout=OPEN_FILE_TIMEOUT):
+        """
+        submit(content) sends one print job and returns the printer's result
+        dict. Without spool_dir, files that fail stay where they are. With
+        close_events, files reported opened wait for their close, for up to
+        open_file_timeout seconds without a change.
+        """
+        self.submit = submit
+        self.archive_dir = archive_dir
+        self.spool_dir = spool_dir
+        self.spool_limit = spool_limit
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.quiet_period = quiet_period
+        self.close_events = close_events
+        self.open_file_timeout = open_file_timeout
+        self._lock = threading.Lock()
+        self._watching = {}  # path -> [size, mtime, unchanged since, first seen, waits for close]
+        self._known = set()  # Paths being watched, queued or processed
+        self._ready = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self._scanning = False
+        self._spool = {}  # Spooled path -> retry metadata
+        self._deferred = deque()  # Ready files held back while the spool is full
+        self._last_success = 0.0
+        os.makedirs(archive_dir, exist_ok=True)
+        if spool_dir:
+            os.makedirs(self._meta_dir, exist_ok=True)
+            os.makedirs(self._failed_dir, exist_ok=True)
+            self._load_spool()
+
+    @property
+    def _meta_dir(self):
+        return os.path.join(self.spool_dir, '.retry')
+
+    @property
+    def _failed_dir(self):
+        return os.path.join(self.spool_dir, 'failed')
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._monitor, daemon=True)]
+        if self.spool_dir:
+            self._threads.append(threading.Thread(target=self._retry_spooled, daemon=True))
+        self._threads += [threading.Thread(target=self._work, daemon=True) for _ in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for _ in range(self.workers):
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def notify(self, path, opened=False):
+        """
+        A file was created, moved in or written to - wait until it stops
+        changing. opened when a writer opened it in place: where the platform
+        reports closes, it then waits for the close.
+        """
+        now = time.monotonic()
+        waits = opened and self.close_events
+        with self._lock:
+            state = self._watching.get(path)
+            if state is not None:
+                state[2] = now
+                state[4] = state[4] or waits
+            elif path not in self._known:
+                self._known.add(path)
+                self._watching[path] = [None, None, now, now, waits]
+
+    def complete(self, path):
+        """The writer closed path or moved it in place - it is ready now"""
+        with self._lock:
+            if path in self._known and path not in self._watching:
+                return  # Already queued
+            self._watching.pop(path, None)
+            self._known.add(path)
+        self._enqueue(path)
+
+    def _enqueue(self, path):
+        """Queue a ready file, or hold it back while the spool is full"""
+        with self._lock:
+            if self._spool_full():
+                self._deferred.append(path)
+                return
+        self._ready.put(path)
+
+    def _spool_full(self):
+        return self.spool_dir is not None and len(self._spool) >= self.spool_limit
+
+    def forget(self, path):
+        """path went away (moved out or deleted) before it was processed"""
+        with self._lock:
+            if self._watching.pop(path, None) is not None:
+                self._known.discard(path)
+
+    def add_existing(self, path):
+        """A file found on disk rather than reported by an event"""
+        with self._lock:
+            state = self._watching.get(path)
+            if state is not None:
+                # Watched already - unchanged for the quiet period, it is done even if no close came
+                if state[0] is None or time.monotonic() - state[2] < self.quiet_period:
+                    return
+                del self._watching[path]
+        if state is not None:
+            self._enqueue(path)
+            return
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        if time.time() - mtime < BACKLOG_MIN_AGE:
+            self.notify(path)
+        else:
+            self.complete(path)
+
+    def scan(self, input_dir, rate=BACKLOG_RATE):
+        """
+        Queue the files already in input_dir, oldest first, in the background
+        at up to rate files per second. Returns how many files were found, or
+        None if a previous scan is still queueing its files.
+        """
+        with self._lock:
+            if self._scanning:
+                return None
+            self._scanning = True
+        try:
+            backlog = []
+            with os.scandir(input_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            backlog.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        continue  # Gone since it was listed
+            backlog.sort()
+        except BaseException:
+            self._scanning = False
+            raise
+        threading.Thread(target=self._feed_backlog, args=([path for _, path in backlog], rate),
+                         daemon=True).start()
+        return len(backlog)
+
+    def _feed_backlog(self, paths, rate):
+        try:
+            started = time.monotonic()
+            for index, path in enumerate(paths):
+                if rate:
+                    delay = started + index / rate - time.monotonic()
+                    if delay > 0 and self._stop.wait(delay):
+                        return
+                # Keep the queue short so files that arrive meanwhile go next
+                while self._ready.qsize() >= self.workers or self._spool_full():
+                    if self._stop.wait(self.poll_interval):
+                        return
+                self.add_existing(path)
+        finally:
+            self._scanning = False
+
+    def pending(self):
+        """Number of files watched, queued or being processed"""
+        with self._lock:
+            return len(self._known)
+
+    def spooled(self):
+        """Number of files waiting in the spool for another attempt"""
+        with self._lock:
+            return len(self._spool)
+
+    def _monitor(self):
+        """Queue watched files whose size and mtime stopped changing - for longer if a close should tell"""
+        while not self._stop.wait(self.poll_interval):
+            with self._lock:
+                watching = list(self._watching.items())
+            ready = []
+            for path, state in watching:
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    self.forget(path)
+                    continue
+                except OSError:
+                    continue  # Locked by the writer, check again next poll
+                now = time.monotonic()
+                with self._lock:
+                    if self._watching.get(path) is not state:
+                        continue  # Handed on
+                    if (stat.st_size, stat.st_mtime_ns) != (state[0], state[1]):
+                        state[0], state[1], state[2] = stat.st_size, stat.st_mtime_ns, now
+                        continue
+                    # A file opened in place waits for on_closed, unless it has been left alone for long
+                    if now - state[2] < (self.open_file_timeout if state[4] else self.quiet_period):
+                        continue
+                    if stat.st_size == 0 and now - state[3] < EMPTY_FILE_GRACE:
+                        continue
+                    if _held_open(path):
+                        continue  # The writer only paused
+                    del self._watching[path]
+                ready.append(path)
+            for path in ready:
+                self._enqueue(path)
+
+    def _work(self):
+        while True:
+            path = self._ready.get()
+            if path is None:
+                return
+            with self._lock:
+                if path not in self._spool and self._spool_full():
+                    self._deferred.append(path)  # Queued before the spool filled up
+                    continue
+            try:
+                self.process_file(path)
+            finally:
+                with self._lock:
+                    self._known.discard(path)
+
+    def process_file(self, filepath):
+        """Submit a print file and archive it once the QR code exists"""
+        try:
+            if not os.path.exists(filepath):
+                return  # Already archived after an overlapping event or scan
+            with self._lock:
+                spooled = self._spool.get(filepath)
+            filename = spooled['filename'] if spooled else os.path.basename(filepath)
+            if spooled:
+                print(f"[{datetime.now()}] Retrying print file: {filename} (attempt {spooled['attempts'] + 1})")
+            else:
+                print(f"[{datetime.now()}] Processing print file: {filename}")
+
+            # Read file content
+            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+                content = f.read()
+
+            if not content.strip():
+                print(f"  Warning: File is empty, skipping...")
+                return
+
+            try:
+                result = self.submit(content)
+            except SubmitError as e:
+                print(f"  ✗ Error: {e}")
+                self._submit_failed(filepath, filename, str(e), e.retryable)
+                return
+            except Exception as e:
+                print(f"  ✗ Error sending to printer service: {str(e)}")
+                self._submit_failed(filepath, filename, str(e), True)
+                return
+            self._last_success = time.time()
+            print(f"  ✓ QR code created: {result['filename']}")
+
+            # Move file to archive
+            archive_path = os.path.join(self.archive_dir, filename)
+            if os.path.exists(filepath):
+                os.rename(filepath, archive_path)
+                print(f"  ✓ File archived to: {archive_path}")
+            if spooled:
+                self._unspool(filepath)
+
+        except Exception as e:
+            print(f"  ✗ Error processing file: {str(e)}")
+
+
+    def _meta_path(self, spool_path):
+        return os.path.join(self._meta_dir, os.path.basename(spool_path) + '.json')
+
+    def _write_meta(self, path, meta):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _load_spool(self):
+        """Pick up the files spooled before a restart - all of them are due right away"""
+        with os.scandir(self.spool_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                try:
+                    with open(self._meta_path(entry.path), 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                except (OSError, ValueError):
+                    # Spooled just before a crash, before its metadata was written
+                    meta = {'filename': entry.name.split('-', 1)[-1], 'attempts': 0, 'failed_at': 0}
+                meta['next_attempt'] = 0
+                self._spool[entry.path] = meta
+
+    def _submit_failed(self, filepath, filename, error, retryable):
+        """Spool a file for another attempt later, or set it aside if it can never succeed"""
+        if not self.spool_dir:
+            return  # Left where it is, as without a spool
+        now = time.time()
+        with self._lock:
+            meta = self._spool.get(filepath) or {'filename': filename, 'attempts': 0}
+        meta['attempts'] += 1
+        meta['failed_at'] = now
+        meta['last_error'] = error
+
+        if not retryable:
+            failed_path = os.path.join(self._failed_dir, f"{time.time_ns()}-{filename}")
+            shutil.move(filepath, failed_path)
+            self._write_meta(failed_path + '.json', meta)
+            self._unspool(filepath)
+            print(f"  ✗ Moved to: {failed_path}")
+            return
+
+        delay = min(RETRY_BASE_DELAY * 2 ** (meta['attempts'] - 1), RETRY_MAX_DELAY)
+        delay *= random.uniform(0.8, 1.2)  # Spread out retries of files that failed together
+        meta['next_attempt'] = now + delay
+        spool_path = filepath
+        if os.path.dirname(os.path.abspath(filepath)) != os.path.abspath(self.spool_dir):
+            spool_path = os.path.join(self.spool_dir, f"{time.time_ns()}-{filename}")
+            shutil.move(filepath, spool_path)
+        self._write_meta(self._meta_path(spool_path), meta)
+        with self._lock:
+            self._spool[spool_path] = meta
+        print(f"  ↻ Spooled for retry in {delay:.0f}s (attempt {meta['attempts']})")
+
+    def _unspool(self, spool_path):
+        with self._lock:
+            self._spool.pop(spool_path, None)
+        try:
+            os.remove(self._meta_path(spool_path))
+        except FileNotFoundError:
+            pass
+
+    def _retry_spooled(self):
+        """Queue spooled files as they come due, and let held back files through when there is room"""
+        interval = 1.0
+        while not self._stop.wait(interval):
+            now = time.time()
+            with self._lock:
+                due = sorted(
+                    (meta['next_attempt'], path) for path, meta in self._spool.items()
+                    if path not in self._known
+                    # A success since the failure means the service is back
+                    and (meta['next_attempt'] <= now or meta['failed_at'] < self._last_success)
+                )
+            room = max(2 * self.workers - self._ready.qsize(), 0)
+            for _, path in due[:room]:
+                with self._lock:
+                    self._known.add(path)
+                self._ready.put(path)
+            with self._lock:
+                while self._deferred and not self._spool_full() and self._ready.qsize() < 2 * self.workers:
+                    self._ready.put(self._deferred.popleft())
+                held_back = bool(self._deferred)
+            # Come back quickly while there is a backlog to drain
+            interval = self.poll_interval if len(due) > room or held_back else 1.0
+
+
+class PrintFileHandler(FileSystemEventHandler):
+    """Feed file system events of the input directory to a PrintIngestor"""
+
+    def __init__(self, ingestor, input_dir):
+        super().__init__()
+        self.ingestor = ingestor
+        self.input_dir = os.path.abspath(input_dir)
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.ingestor.notify(event.src_path)
+
+    def on_opened(self, event):
+        if not event.is_directory:
+            self.ingestor.notify(event.src_path, opened=True)
+
+    def on_modified(self, event):
+        if not event.is_directory:
+            self.ingestor.notify(event.src_path)
+
+    def on_closed(self, event):
+        if not event.is_directory:
+            self.ingestor.complete(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        self.ingestor.forget(event.src_path)
+        # Writers that rename a finished temp file into place
+        if os.path.dirname(os.path.abspath(event.dest_path)) == self.input_dir:
+            self.ingestor.complete(event.dest_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            self.ingestor.forget(event.src_path)
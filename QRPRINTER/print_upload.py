@@ -0,0 +1,164 @@
+"""
+Print Upload - Reads print request bodies within size limits
+
+A body whose declared length is over the limit is refused before any of it
+is read. Plain-text bodies are streamed to a temporary file in chunks, hashed
+and measured as they arrive, so a mistaken multi-MB upload is cut off after
+its first chunk instead of being buffered and handed to qrcode. The file is
+then moved into place as the job's content file.
+"""
+import os
+import json
+import codecs
+import threading
+from flask import request
+from qr_render import MAX_QR_BITS, MAX_QR_CHARS, MAX_SYMBOLS, QRCapacityError, least_bits, plan_symbols, render_digest
+
+# Largest /print body, and largest /print/batch body (Flask's MAX_CONTENT_LENGTH)
+MAX_PRINT_BYTES = 1024 * 1024
+MAX_BATCH_BYTES = 64 * 1024 * 1024
+# Bytes read from the request per chunk
+CHUNK_SIZE = 64 * 1024
+FORM_MIMETYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+
+class PrintPayloadError(Exception):
+    """A print request body that is refused, with the HTTP status to answer"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class PrintUpload:
+    """
+    Print content of one request and how it is laid out in QR symbols (its
+    plan_symbols(), once checked). For a streamed body, path is the temporary
+    file holding it (to move into place as N.txt) and key its render_key().
+    """
+
+    def __init__(self, content, path=None, key=None, size=None, layout=None):
+        self.content = content
+        self.path = path
+        self.key = key
+        self.size = size
+        self.layout = layout
+
+    @property
+    def symbols(self):
+        """Number of QR symbols the content needs"""
+        return len(self.layout) if self.layout else 1
+
+    def discard(self):
+        """Remove the temporary file, if it was not moved into place"""
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+def job_content(job):
+    """
+    Print content of a JSON print job object - its 'content' or 'text', else
+    the whole object as JSON. A value that is not a string is printed as its
+    JSON too, e.g. {"content": 123} as 123.
+    """
+    content = job.get('content', '') or job.get('text', '') or job
+    return content if isinstance(content, str) else json.dumps(content)
+
+
+def _check_declared_length(limit):
+    length = request.content_length
+    if length is not None and length > limit:
+        raise PrintPayloadError(f"Request body too large ({length} bytes, at most {limit})", 413)
+
+
+def _body_chunks(limit):
+    """The request body in chunks - 413 as soon as it passes limit, also without a Content-Length"""
+    received = 0
+    while True:
+        chunk = request.stream.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        received += len(chunk)
+        if received > limit:
+            raise PrintPayloadError(f"Request body too large (more than {limit} bytes)", 413)
+        yield chunk
+
+
+def read_body(limit):
+    """
+    The whole request body, refused with PrintPayloadError 413 once it passes
+    limit. Unlike request.get_data(), an over-limit body without a
+    Content-Length is refused rather than silently cut short.
+    """
+    _check_declared_length(limit)
+    return b''.join(_body_chunks(limit))
+
+
+def _stream_text(spool_dir, formats, limit):
+    """Stream a plain-text body to a temporary file in spool_dir, returns a PrintUpload"""
+    digest = render_digest(formats)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    chars = bits = size = 0
+    path = os.path.join(spool_dir, f".upload-{os.getpid()}-{threading.get_ident()}.tmp")
+    try:
+        with open(path, 'wb') as f:
+            for chunk in _body_chunks(limit):
+                text = decoder.decode(chunk)
+                chars += len(text)
+                if chars > MAX_QR_CHARS:
+                    raise PrintPayloadError(f"Content too large for {MAX_SYMBOLS} QR codes (more than {MAX_QR_CHARS} characters)", 422)
+                bits += least_bits(chunk, len(text))
+                if bits > MAX_QR_BITS:
+                    raise PrintPayloadError(f"Content too large for {MAX_SYMBOLS} QR codes (more than {size + len(chunk)} bytes)", 422)
+                digest.update(chunk)
+                f.write(chunk)
+                parts.append(text)
+                size += len(chunk)
+            parts.append(decoder.decode(b'', final=True))
+    except UnicodeDecodeError:
+        os.remove(path)
+        raise PrintPayloadError("Print content is not valid UTF-8", 400) from None
+    except BaseException:
+        os.remove(path)
+        raise
+    return PrintUpload(''.join(parts), path, digest.hexdigest(), size)
+
+
+def receive_print_content(spool_dir, formats=('png',), limit=MAX_PRINT_BYTES):
+    """
+    Print content of the current /print request as a PrintUpload. JSON and
+    form bodies are read within limit and parsed; any other body is streamed
+    to a temporary file in spool_dir, which must be on the same filesystem as
+    the content files. Raises PrintPayloadError - 400 without content, 413 when
+    the body is over limit, 422 when it cannot fit in MAX_SYMBOLS QR codes.
+    """
+    _check_declared_length(limit)
+    if request.is_json:
+        try:
+            data = json.loads(read_body(limit))
+        except ValueError:
+            raise PrintPayloadError("Invalid JSON", 400) from None
+        if isinstance(data, dict):
+            upload = PrintUpload(job_content(data))
+        else:
+            upload = PrintUpload(json.dumps(data) if data is not None else '')
+    elif request.mimetype in FORM_MIMETYPES:
+        upload = PrintUpload(request.form.get('content', ''))
+    else:
+        upload = _stream_text(spool_dir, formats, limit)
+
+    try:
+        if not upload.content:
+            raise PrintPayloadError("No print content provided", 400)
+        upload.layout = plan_symbols(upload.content)
+    except QRCapacityError as e:
+        upload.discard()
+        raise PrintPayloadError(str(e), 422) from None
+    except PrintPayloadError:
+        upload.discard()
+        raise
+    return upload
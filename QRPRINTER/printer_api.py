@@ -0,0 +1,510 @@
+"""
+Printer API - The print endpoints, shared by printer_service.py and qr_printer_system.py
+
+Holds the printer's configuration, job storage, job numbers, render cache and
+metrics, and the blueprint serving /print, /print/batch, /jobs, /last_qr,
+/print_content, /render_cache, /metrics and /health. Each entry point
+registers the blueprint on its own app; the all-in-one system also listens
+for published jobs with on_published() to push them to its screens.
+"""
+import os
+import json
+import math
+from flask import Blueprint, Response, current_app, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+from datetime import datetime
+from job_sequence import JobSequence, write_number_atomic
+from job_storage import JobStorage, manifest_filename, symbol_filenames
+from job_index import DEFAULT_PAGE, DONE, FAILED, MAX_PAGE, JobIndex
+from http_cache import job_json_response
+from qr_render import QRRenderCache, QRCapacityError, plan_symbols, rendered_version
+from print_upload import MAX_BATCH_BYTES, MAX_PRINT_BYTES, PrintPayloadError, job_content, read_body, receive_print_content
+from render_jobs import RenderJobs
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry
+
+# Directory to store QR code images
+QR_OUTPUT_DIR = "qr_codes"
+# Directory to store print content
+PRINT_CONTENT_DIR = "print_content"
+# File holding the number of the last completed job
+COUNTER_FILE = "counter.txt"
+# File holding the highest job number reserved by any printer process
+SEQUENCE_FILE = "sequence.txt"
+# SQLite table of every job, also read by the display
+JOB_INDEX_FILE = "jobs.db"
+# Memory budget for cached QR renders, and optional directory to keep them on disk
+RENDER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RENDER_CACHE_DIR = None
+# Largest number of jobs accepted by /print/batch
+MAX_BATCH_SIZE = 10000
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/jsonl')
+# QR output formats written for every job, e.g. ('png', 'svg') - the first one is shown on the display
+QR_FORMATS = ('png',)
+# Store job files as <dir>/000/123/123456.png instead of one flat directory
+SHARDED_STORAGE = True
+# Accept /print with 202 and render in the background unless the request says otherwise
+ASYNC_RENDER = False
+# Longest a /jobs/<id>?wait=... request may block, in seconds
+MAX_JOB_WAIT = 30
+# Job files older than this many days are rolled into per-day zip segments in <dir>/archive/
+ARCHIVE_AFTER_DAYS = 7
+# Days before archived jobs are deleted - None keeps them forever
+RETENTION_DAYS = None
+
+api = Blueprint('printer', __name__)
+
+# Ensure output directories exist
+os.makedirs(QR_OUTPUT_DIR, exist_ok=True)
+os.makedirs(PRINT_CONTENT_DIR, exist_ok=True)
+
+# Per-job files (N.png, N.txt) - sharded so lookups stay flat as jobs grow
+qr_storage = JobStorage(QR_OUTPUT_DIR, sharded=SHARDED_STORAGE)
+content_storage = JobStorage(PRINT_CONTENT_DIR, sharded=SHARDED_STORAGE)
+job_index = JobIndex(JOB_INDEX_FILE)
+# Jobs queued when a printer process stopped would be reported queued forever
+_stale_jobs = job_index.fail_stale()
+if _stale_jobs:
+    print(f"Marked {_stale_jobs} print jobs left queued by a stopped printer as failed")
+
+job_sequence = JobSequence(SEQUENCE_FILE, legacy_counter_file=COUNTER_FILE)
+
+# Prometheus metrics served on /metrics - the entry points instrument their app with them
+metrics = MetricsRegistry('qrprinter_')
+STAGE_SECONDS = metrics.histogram('stage_seconds', 'Time spent in each stage of a print job', ('stage',))
+BYTES_WRITTEN = metrics.counter('bytes_written_total', 'Bytes of job files written', ('kind',))
+QR_VERSIONS = metrics.counter('qr_version_total', 'Rendered QR codes by QR version', ('version',))
+QR_VERSIONS_SAVED = metrics.counter('qr_versions_saved_total', 'QR versions saved by optimal segmentation, summed over rendered QR codes')
+RENDER_CACHE_LOOKUPS = metrics.counter('render_cache_lookups_total', 'Render cache lookups by result', ('result',))
+
+# Called with the job number whenever a job becomes the latest one
+_published_listeners = []
+
+
+def record_render(timings):
+    """Metrics of one QR render, reported by the render cache"""
+    STAGE_SECONDS.observe(timings['make_seconds'], stage='qr_make')
+    STAGE_SECONDS.observe(timings['encode_seconds'], stage='encode')
+    QR_VERSIONS.inc(version=timings['version'])
+    QR_VERSIONS_SAVED.inc(timings['versions_saved'])
+
+
+@metrics.on_collect
+def collect_render_cache():
+    stats = render_cache.stats()
+    for result in ('memory_hits', 'disk_hits', 'misses'):
+        RENDER_CACHE_LOOKUPS.set_total(stats[result], result=result)
+
+
+render_cache = QRRenderCache(RENDER_CACHE_MAX_BYTES, RENDER_CACHE_DIR, on_render=record_render)
+render_jobs = RenderJobs(render_cache)
+
+
+@api.record_once
+def limit_request_bodies(state):
+    # Bodies over this are refused with 413 before they are read (/print has its own, smaller limit)
+    state.app.config['MAX_CONTENT_LENGTH'] = MAX_BATCH_BYTES
+
+
+@api.before_request
+def refuse_oversized_bodies():
+    """413 for a declared Content-Length over the route's own limit, before any of the body is read"""
+    limit = MAX_BATCH_BYTES if request.endpoint == 'printer.handle_print_batch' else MAX_PRINT_BYTES
+    length = request.content_length
+    if length is not None and length > limit:
+        return jsonify({'error': f"Request body too large ({length} bytes, at most {limit})"}), 413
+
+
+def on_published(listener):
+    """Call listener(file_number) after every job that becomes the latest one, e.g. to push it to screens"""
+    _published_listeners.append(listener)
+    return listener
+
+
+def get_next_file_number():
+    """Get the next incrementing file number"""
+    with STAGE_SECONDS.time(stage='allocate'):
+        return job_sequence.next()
+
+
+def publish_latest(file_number):
+    """Record the last completed job so the display picks it up"""
+    write_number_atomic(COUNTER_FILE, file_number)
+    for listener in _published_listeners:
+        listener(file_number)
+
+
+def wants_async_render():
+    """Async mode from ?async=1/0 or a "Prefer: respond-async" header, else ASYNC_RENDER"""
+    flag = request.args.get('async')
+    if flag is not None:
+        return flag.lower() in ('1', 'true', 'yes')
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return True
+    return ASYNC_RENDER
+
+
+def qr_filenames(file_number, symbols=1, fmt=None):
+    """QR code filenames of a job with that many symbols, in the first configured format unless fmt is given"""
+    return symbol_filenames(file_number, symbols, fmt or QR_FORMATS[0])
+
+
+def qr_file_info(file_number, symbols=1, fmt=None):
+    """'filename' of a job's QR code for responses, plus 'symbols' listing every one of a split job"""
+    filenames = qr_filenames(file_number, symbols, fmt)
+    if len(filenames) == 1:
+        return {'filename': filenames[0]}
+    return {'filename': filenames[0], 'symbols': filenames}
+
+
+def save_print_content(content_filename, print_content):
+    """Write a job's print content file"""
+    with STAGE_SECONDS.time(stage='content_write'):
+        content = print_content.encode('utf-8')
+        content_storage.write_bytes(content_filename, content)
+    BYTES_WRITTEN.inc(len(content), kind='content')
+
+
+def save_print_upload(content_filename, upload):
+    """Write a job's print content file from a request - a streamed body is moved into place"""
+    if upload.path is None:
+        save_print_content(content_filename, upload.content)
+        return
+    with STAGE_SECONDS.time(stage='content_write'):
+        content_storage.move_in(content_filename, upload.path)
+    upload.path = None
+    BYTES_WRITTEN.inc(upload.size, kind='content')
+
+
+def save_qr_files(file_number, rendered):
+    """
+    Write every rendered format of a job's QR code, returns the path of the
+    first one. Content split over several symbols (a list of renders) is
+    written as N-1 ... N-k plus an N.json manifest listing them.
+    """
+    symbols = rendered if isinstance(rendered, list) else [rendered]
+    files = {}
+    with STAGE_SECONDS.time(stage='save'):
+        for fmt in symbols[0]:
+            files[fmt] = qr_filenames(file_number, len(symbols), fmt)
+            for filename, symbol in zip(files[fmt], symbols):
+                qr_storage.write_bytes(filename, symbol[fmt])
+                BYTES_WRITTEN.inc(len(symbol[fmt]), kind=fmt)
+        if len(symbols) > 1:
+            manifest = {'file_number': file_number, 'symbols': len(symbols), 'files': files}
+            qr_storage.write_text(manifest_filename(file_number), json.dumps(manifest))
+    return qr_storage.path(qr_filenames(file_number, len(symbols))[0])
+
+
+def symbol_count(rendered):
+    """Number of QR symbols in a render - a list for a structured-append sequence"""
+    return len(rendered) if isinstance(rendered, list) else 1
+
+
+def create_qr_code(data, file_number, key=None, layout=None):
+    """Create the QR code files of a job and index it as done - repeated content is served from the render cache"""
+    rendered = render_cache.get_or_render(data, QR_FORMATS, key, layout)
+    filepath = save_qr_files(file_number, rendered)
+    job_index.add(file_number, data, symbol_count(rendered), QR_FORMATS, DONE, rendered_version(rendered))
+    return filepath
+
+
+def save_rendered_job(file_number, rendered):
+    """Write the QR code files of a job rendered in the background and mark it done in the job index"""
+    save_qr_files(file_number, rendered)
+    job_index.complete(file_number, rendered_version(rendered))
+
+
+def record_failed_job(file_number, error):
+    """Mark a job whose background render failed in the job index"""
+    job_index.complete(file_number, error=error)
+
+
+def job_status(job):
+    """A job index row as the job endpoints report it - QR filenames instead of the symbol count"""
+    job = dict(job)
+    job.update(qr_file_info(job['job_id'], job.pop('symbols'), job['formats'][0]))
+    job['content_filename'] = f"{job['job_id']}.txt"
+    return job
+
+
+def submit_print_job(upload, render_async=False):
+    """
+    Save and render one print job (a PrintUpload) - shared by /print and the
+    all-in-one system's file watcher, which skips the HTTP round trip.
+    Returns the job's result; with render_async the QR code is rendered in
+    the background.
+    """
+    print_content = upload.content
+    file_number = get_next_file_number()
+    files = qr_file_info(file_number, upload.symbols)
+    filename = files['filename']
+    content_filename = f"{file_number}.txt"
+
+    # Save print content to text file
+    save_print_upload(content_filename, upload)
+
+    if render_async:
+        # Hand rendering to the worker pool and answer right away
+        job_index.add(file_number, print_content, upload.symbols, QR_FORMATS)
+        job = render_jobs.submit(file_number, print_content, save_rendered_job,
+                                 formats=QR_FORMATS, on_done=publish_latest,
+                                 on_failed=record_failed_job, layout=upload.layout, **files)
+        print(f"[{datetime.now()}] Print job #{file_number} accepted - rendering in background")
+        return {
+            'success': True,
+            'status': job['status'],
+            'job_id': file_number,
+            **files,
+            'content_filename': content_filename,
+            'file_number': file_number,
+            'status_url': f"/jobs/{file_number}"
+        }
+
+    # Create QR code
+    filepath = create_qr_code(print_content, file_number, upload.key, upload.layout)
+    publish_latest(file_number)
+
+    print(f"[{datetime.now()}] Print job #{file_number} - QR saved as {filename}")
+
+    return {
+        'success': True,
+        **files,
+        'content_filename': content_filename,
+        'file_number': file_number,
+        'filepath': filepath
+    }
+
+
+@api.route('/print', methods=['POST'])
+def handle_print():
+    """Handle print requests from computer/server"""
+    upload = None
+    try:
+        # Get print data from request - refused early if too large for the body limit or its QR codes
+        upload = receive_print_content(PRINT_CONTENT_DIR, QR_FORMATS)
+
+        render_async = wants_async_render()
+        result = submit_print_job(upload, render_async)
+        return jsonify(result), 202 if render_async else 200
+
+    except PrintPayloadError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        print(f"Error processing print job: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    finally:
+        if upload is not None:
+            upload.discard()
+
+
+@api.route('/print/batch', methods=['POST'])
+def handle_print_batch():
+    """Handle many print jobs in one request - a JSON array or NDJSON lines"""
+    try:
+        body = read_body(MAX_BATCH_BYTES)
+        if request.mimetype in NDJSON_MIMETYPES:
+            items = [json.loads(line) for line in body.decode('utf-8', 'replace').splitlines() if line.strip()]
+        else:
+            try:
+                items = json.loads(body)
+            except ValueError:
+                items = None
+            if isinstance(items, dict):
+                items = items.get('jobs')
+        if not isinstance(items, list):
+            return jsonify({'error': 'Expected a JSON array of print jobs'}), 400
+    except PrintPayloadError as e:
+        return jsonify({'error': str(e)}), e.status
+    except ValueError as e:
+        return jsonify({'error': f'Invalid NDJSON: {str(e)}'}), 400
+
+    if len(items) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'Batch too large (max {MAX_BATCH_SIZE} jobs)'}), 413
+
+    try:
+        # Extract content the same way handle_print() does
+        contents = []
+        for item in items:
+            if isinstance(item, dict):
+                contents.append(job_content(item))
+            elif isinstance(item, str):
+                contents.append(item)
+            else:
+                contents.append(json.dumps(item) if item is not None else '')
+
+        results = [{'success': False, 'error': 'No print content provided'} for _ in contents]
+        layouts = [None] * len(contents)
+        valid = []
+        for index, content in enumerate(contents):
+            if not content:
+                continue
+            try:
+                # Refuse content that cannot fit before it takes a job number
+                layouts[index] = plan_symbols(content)
+            except QRCapacityError as e:
+                results[index] = {'success': False, 'error': str(e)}
+                continue
+            valid.append(index)
+        if not valid:
+            return jsonify({'success': True, 'succeeded': 0, 'failed': len(contents), 'results': results}), 200
+
+        # One reservation for the whole batch, then render in parallel
+        numbers = job_sequence.reserve(len(valid))
+        renders = render_cache.render_many([contents[index] for index in valid], QR_FORMATS,
+                                           layouts=[layouts[index] for index in valid])
+
+        last_number = None
+        indexed = []
+        for index, file_number, rendered in zip(valid, numbers, renders):
+            files = qr_file_info(file_number, len(layouts[index]))
+            content_filename = f"{file_number}.txt"
+            try:
+                if isinstance(rendered, Exception):
+                    raise rendered
+                save_print_content(content_filename, contents[index])
+                filepath = save_qr_files(file_number, rendered)
+                indexed.append((file_number, contents[index], symbol_count(rendered), QR_FORMATS, DONE,
+                                rendered_version(rendered), None))
+                last_number = file_number
+                results[index] = {
+                    'success': True,
+                    **files,
+                    'content_filename': content_filename,
+                    'file_number': file_number,
+                    'filepath': filepath
+                }
+            except Exception as e:
+                results[index] = {'success': False, 'file_number': file_number, 'error': str(e)}
+                indexed.append((file_number, contents[index], len(layouts[index]), QR_FORMATS, FAILED, None, str(e)))
+
+        # One transaction for the whole batch
+        job_index.add_many(indexed)
+        if last_number is not None:
+            publish_latest(last_number)
+
+        succeeded = sum(1 for result in results if result['success'])
+        print(f"[{datetime.now()}] Print batch received - {succeeded}/{len(results)} jobs saved")
+
+        return jsonify({
+            'success': True,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded,
+            'results': results
+        }), 200
+
+    except Exception as e:
+        print(f"Error processing print batch: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@api.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Status of a print job - ?wait=N blocks up to N seconds (at most MAX_JOB_WAIT) for it to finish"""
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = None
+    if wait is None or not math.isfinite(wait) or wait < 0:
+        return jsonify({'error': 'wait must be a number of seconds, 0 or more'}), 400
+    wait = min(wait, MAX_JOB_WAIT)
+
+    job = render_jobs.status(job_id, wait=wait)
+    # Jobs rendered by another process are waited for in the index
+    indexed = job_index.get(job_id, wait=0 if job is not None else wait)
+    if indexed is not None:
+        job = dict(job_status(indexed), **(job or {}))
+    elif job is None:
+        # Printed before the job index existed - the QR file tells whether it finished
+        filenames = qr_storage.find_symbols(job_id, QR_FORMATS[:1])
+        if not filenames:
+            return jsonify({'error': 'Job not found'}), 404
+        job = {'job_id': job_id, 'status': 'done', **qr_file_info(job_id, len(filenames))}
+
+    job['content_filename'] = f"{job_id}.txt"
+    return jsonify(job), 200
+
+
+@api.route('/jobs', methods=['GET'])
+def list_jobs():
+    """Jobs numbered after ?since=N, lowest first, ?limit=M at a time (at most MAX_PAGE) - from the job index"""
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', DEFAULT_PAGE))
+    except ValueError:
+        return jsonify({'error': 'since and limit must be whole numbers'}), 400
+    limit = max(1, min(limit, MAX_PAGE))
+
+    jobs = [job_status(job) for job in job_index.since(since, limit)]
+    # A full page may not be the last - ask again with since=next_since
+    next_since = jobs[-1]['job_id'] if len(jobs) == limit else None
+    return jsonify({'jobs': jobs, 'next_since': next_since}), 200
+
+
+@api.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    return jsonify({'status': 'ok', 'service': 'printer_service'}), 200
+
+
+@api.route('/render_cache', methods=['GET'])
+def render_cache_stats():
+    """Hit/miss counters of the QR render cache"""
+    return jsonify(render_cache.stats()), 200
+
+
+@api.app_errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    """JSON 413 for bodies over MAX_CONTENT_LENGTH"""
+    return jsonify({'error': f"Request body too large (at most {current_app.config['MAX_CONTENT_LENGTH']} bytes)"}), 413
+
+
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Stage timings, request counts and render statistics in the Prometheus text format"""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@api.route('/last_qr', methods=['GET'])
+def get_last_qr():
+    """Get the filename of the last generated QR code"""
+    try:
+        job = job_index.latest()
+        if job is not None:
+            number = job['job_id']
+            return jsonify({
+                **qr_file_info(number, job['symbols'], job['formats'][0]),
+                'content_filename': f"{number}.txt",
+                'file_number': number,
+                'exists': True
+            }), 200
+        # Nothing indexed yet - jobs printed before the job index
+        if os.path.exists(COUNTER_FILE):
+            with open(COUNTER_FILE, 'r') as f:
+                number = int(f.read().strip())
+            filenames = qr_storage.find_symbols(number, QR_FORMATS[:1])
+            content_filename = f"{number}.txt"
+            if filenames:
+                return jsonify({
+                    **qr_file_info(number, len(filenames)),
+                    'content_filename': content_filename,
+                    'file_number': number,
+                    'exists': True
+                }), 200
+        return jsonify({'exists': False}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@api.route('/print_content/<filename>', methods=['GET'])
+def get_print_content(filename):
+    """Get the print content text file"""
+    try:
+        content = content_storage.read_text(filename)
+        if content is not None:
+            return job_json_response({
+                'content': content,
+                'filename': filename
+            })
+        return jsonify({'error': 'Content file not found'}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
@@ -1,174 +1,84 @@
 """
 QR Printer System - All-in-one solution
 Combines printer service, display server, and file watcher
+
+The printer endpoints, and the settings at the top of printer_api.py, are
+shared with printer_service.py.
 """
 import os
-import json
+import argparse
 import time
 import threading
-import requests
-from flask import Flask, request, jsonify, send_file
-from datetime import datetime
-import qrcode
-from PIL import Image
+from flask import Flask, Response, request, jsonify, stream_with_context
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
+from job_archive import Compactor, JobArchive
+from job_index import DONE
+from http_cache import job_json_response, send_job_bytes, send_job_file
+from http_compress import StaticPage, compress_app
+from qr_render import QRCapacityError, plan_symbols, MIMETYPES as QR_MIMETYPES, qr_data_uri
+from print_upload import PrintUpload
+from printer_api import (ARCHIVE_AFTER_DAYS, COUNTER_FILE, QR_FORMATS, QR_OUTPUT_DIR, RETENTION_DAYS, api,
+                         content_storage, job_index, metrics as printer_metrics, on_published, qr_filenames,
+                         qr_storage, submit_print_job)
+from display_events import JobEventBroker, event_stream_full_response, event_stream_headers
+from print_ingest import PrintFileHandler, PrintIngestor, SubmitError
+from serving import SCREENS, add_server_arguments, serve
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsRegistry, instrument_app
 
 # ============================================================================
-# CONFIGURATION
+# CONFIGURATION - the printer's own settings are in printer_api.py
 # ============================================================================
-QR_OUTPUT_DIR = "qr_codes"
-PRINT_CONTENT_DIR = "print_content"
 PRINT_INPUT_DIR = "print_input"
 PRINT_ARCHIVE_DIR = "print_archive"
-COUNTER_FILE = "counter.txt"
+PRINT_PENDING_DIR = "print_pending"  # Print files waiting for another attempt, with their retry state
+RESCAN_INTERVAL = 300  # Seconds between rescans of print_input for files without an event, None to disable
 
 PRINTER_SERVICE_PORT = 5000
 DISPLAY_SERVER_PORT = 8080
 
 # Ensure directories exist
-os.makedirs(QR_OUTPUT_DIR, exist_ok=True)
-os.makedirs(PRINT_CONTENT_DIR, exist_ok=True)
 os.makedirs(PRINT_INPUT_DIR, exist_ok=True)
 os.makedirs(PRINT_ARCHIVE_DIR, exist_ok=True)
 
+compactor = Compactor([qr_storage.archive, content_storage.archive, JobArchive(PRINT_ARCHIVE_DIR)],
+                      archive_after_days=ARCHIVE_AFTER_DAYS, retention_days=RETENTION_DAYS)
+
 # ============================================================================
 # PRINTER SERVICE (Flask App on port 5000)
 # ============================================================================
 printer_app = Flask(__name__)
 printer_app.config['JSON_AS_ASCII'] = False
+printer_app.register_blueprint(api)
+instrument_app(printer_app, printer_metrics)
 
 
-def get_next_file_number():
-    """Get the next incrementing file number"""
-    if os.path.exists(COUNTER_FILE):
-        try:
-            with open(COUNTER_FILE, 'r') as f:
-                number = int(f.read().strip())
-        except (ValueError, IOError):
-            number = 0
-    else:
-        number = 0
-    
-    number += 1
-    with open(COUNTER_FILE, 'w') as f:
-        f.write(str(number))
-    
-    return number
-
-
-def create_qr_code(data, filename):
-    """Create a QR code PNG file - less dense, more readable"""
-    qr = qrcode.QRCode(
-        version=None,
-        error_correction=qrcode.constants.ERROR_CORRECT_M,
-        box_size=20,  # Larger boxes for less density
-        border=8,  # Larger border for better spacing
-    )
-    
-    qr.add_data(data)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    
-    filepath = os.path.join(QR_OUTPUT_DIR, filename)
-    img.save(filepath)
-    
-    return filepath
-
-
-@printer_app.route('/print', methods=['POST'])
-def handle_print():
-    """Handle print requests from computer/server"""
-    try:
-        if request.is_json:
-            data = request.get_json()
-            print_content = data.get('content', '') or data.get('text', '') or json.dumps(data)
-        else:
-            print_content = request.data.decode('utf-8') if request.data else request.form.get('content', '')
-        
-        if not print_content:
-            return jsonify({'error': 'No print content provided'}), 400
-        
-        file_number = get_next_file_number()
-        filename = f"{file_number}.png"
-        content_filename = f"{file_number}.txt"
-        
-        # Save print content
-        content_filepath = os.path.join(PRINT_CONTENT_DIR, content_filename)
-        with open(content_filepath, 'w', encoding='utf-8') as f:
-            f.write(print_content)
-        
-        # Create QR code
-        filepath = create_qr_code(print_content, filename)
-        
-        print(f"[{datetime.now()}] Print job #{file_number} - QR saved as {filename}")
-        
-        return jsonify({
-            'success': True,
-            'filename': filename,
-            'content_filename': content_filename,
-            'file_number': file_number,
-            'filepath': filepath
-        }), 200
-        
-    except Exception as e:
-        print(f"Error processing print job: {str(e)}")
-        return jsonify({'error': str(e)}), 500
-
-
-@printer_app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({'status': 'ok', 'service': 'printer_service'}), 200
-
-
-@printer_app.route('/last_qr', methods=['GET'])
-def get_last_qr():
-    """Get the filename of the last generated QR code"""
+def ingest_print_file(content):
+    """Submit a watched print file - content too large for the QR codes of a job is set aside, not retried"""
     try:
-        if os.path.exists(COUNTER_FILE):
-            with open(COUNTER_FILE, 'r') as f:
-                number = int(f.read().strip())
-            filename = f"{number}.png"
-            content_filename = f"{number}.txt"
-            filepath = os.path.join(QR_OUTPUT_DIR, filename)
-            if os.path.exists(filepath):
-                return jsonify({
-                    'filename': filename,
-                    'content_filename': content_filename,
-                    'file_number': number,
-                    'exists': True
-                }), 200
-        return jsonify({'exists': False}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        layout = plan_symbols(content)
+    except QRCapacityError as e:
+        raise SubmitError(str(e), retryable=False) from None
+    return submit_print_job(PrintUpload(content, layout=layout))
 
 
-@printer_app.route('/print_content/<filename>', methods=['GET'])
-def get_print_content(filename):
-    """Get the print content text file"""
-    try:
-        filepath = os.path.join(PRINT_CONTENT_DIR, filename)
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            return jsonify({
-                'content': content,
-                'filename': filename
-            }), 200
-        return jsonify({'error': 'Content file not found'}), 404
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+@printer_app.route('/print_input/scan', methods=['POST'])
+def scan_print_input():
+    """Queue the files waiting in print_input, e.g. after copying in a backlog"""
+    found = print_ingestor.scan(PRINT_INPUT_DIR)
+    if found is None:
+        return jsonify({'success': False, 'error': 'A scan is already in progress'}), 409
+    return jsonify({'success': True, 'found': found}), 202
 
 
-def run_printer_service():
-    """Run the printer service on port 5000"""
+def run_printer_service(server_options=None):
+    """Run the printer service on port 5000 - server_options are passed to serving.serve()"""
     print("=" * 60)
     print("QR Printer Service Starting...")
     print(f"QR codes will be saved to: {os.path.abspath(QR_OUTPUT_DIR)}")
     print(f"Listening on http://localhost:{PRINTER_SERVICE_PORT}/print")
     print("=" * 60)
-    printer_app.run(host='0.0.0.0', port=PRINTER_SERVICE_PORT, debug=False, use_reloader=False)
+    # Screens only connect to the display server
+    serve(printer_app, host='0.0.0.0', port=PRINTER_SERVICE_PORT, **dict(server_options or {}, screens=0))
 
 
 # ============================================================================
@@ -177,28 +87,97 @@ def run_printer_service():
 display_app = Flask(__name__)
 display_app.config['JSON_AS_ASCII'] = False
 
+# Pushes new jobs to connected screens - fed directly by the printer service
+job_events = JobEventBroker(max_subscribers=SCREENS)
+
+# Request counts and latency of the display routes, served on /metrics
+display_metrics = MetricsRegistry('qrdisplay_')
+compress_app(display_app)
+instrument_app(display_app, display_metrics)
+DISPLAY_CLIENTS = display_metrics.gauge('event_subscribers', 'Screens connected to /api/events')
 
-def get_latest_qr_filename():
-    """Get the filename of the latest QR code"""
+
+@display_metrics.on_collect
+def collect_display_clients():
+    DISPLAY_CLIENTS.set(job_events.subscriber_count())
+
+
+def latest_job_number():
+    """Number of the last completed job from the counter file, or None"""
     try:
         if os.path.exists(COUNTER_FILE):
             with open(COUNTER_FILE, 'r') as f:
-                number = int(f.read().strip())
-            filename = f"{number}.png"
-            content_filename = f"{number}.txt"
-            filepath = os.path.join(QR_OUTPUT_DIR, filename)
-            content_filepath = os.path.join(PRINT_CONTENT_DIR, content_filename)
-            if os.path.exists(filepath):
-                return filename, filepath, content_filename, content_filepath
+                return int(f.read().strip())
     except Exception as e:
         print(f"Error getting latest QR: {e}")
-    return None, None, None, None
+    return None
 
 
-@display_app.route('/')
-def index():
-    """Main page that displays the print content"""
-    html = """
+def job_info(number, job=None):
+    """
+    Describe a job the way /api/latest reports it - symbols lists every QR
+    code of a split job. Answered from its job index row (looked up unless
+    given), for jobs from before the index from its files.
+    """
+    if job is None:
+        job = job_index.get(number)
+    if job is not None:
+        symbols = qr_filenames(number, job['symbols'], job['formats'][0]) if job['status'] == DONE else []
+    else:
+        symbols = qr_storage.find_symbols(number, QR_FORMATS[:1])
+    if not symbols:
+        return {'exists': False}
+    info = {
+        'exists': True,
+        'filename': symbols[0],
+        'content_filename': f"{number}.txt",
+        'file_number': number
+    }
+    if len(symbols) > 1:
+        info['symbols'] = symbols
+    return info
+
+
+def latest_job_info():
+    """Describe the latest job the way /api/latest reports it"""
+    job = job_index.latest()
+    if job is not None:
+        return job_info(job['job_id'], job)
+    number = latest_job_number()
+    return job_info(number) if number is not None else {'exists': False}
+
+
+def inline_job_info(info, content=None):
+    """info plus the job's text and QR image as a data URI (all of them in qr_data_uris for a split job), so a screen needs no further requests"""
+    if not info['exists']:
+        return info
+    if content is None:
+        content = content_storage.read_text(info['content_filename'])
+    uris = []
+    for filename in info.get('symbols', [info['filename']]):
+        image = qr_storage.read_bytes(filename)
+        if content is None or image is None:
+            return info
+        uris.append(qr_data_uri(image, os.path.splitext(filename)[1].lstrip('.')))
+    if len(uris) > 1:
+        return dict(info, content=content, qr_data_uri=uris[0], qr_data_uris=uris)
+    return dict(info, content=content, qr_data_uri=uris[0])
+
+
+@on_published
+def push_latest_job(file_number):
+    """Push each new latest job to connected screens"""
+    # Screens get everything they need to show the job in the event itself
+    job_events.publish(inline_job_info(job_info(file_number)))
+
+
+def wants_inline():
+    """?inline=1 asks /api/latest for the content and QR image too"""
+    return request.args.get('inline', '').lower() in ('1', 'true', 'yes')
+
+
+# The page is the same for every screen - it is built and compressed once, at import
+INDEX_HTML = """
     <!DOCTYPE html>
     <html lang="he" dir="rtl">
     <head>
@@ -336,72 +315,58 @@ def index():
         <script>
             let countdownTimer = null;
             let displayTimer = null;
+            let symbolTimer = null;
+            const SYMBOL_INTERVAL = 1500;  // ms each QR code of a sequence is shown
             let currentPrintNumber = null;
             
             function updateDisplay() {
+                // Polls only need the job number - a new job's content and QR image are fetched once it changes
                 fetch('/api/latest')
                     .then(response => response.json())
-                    .then(data => {
-                        const container = document.getElementById('container');
-                        const printDisplay = document.getElementById('print-display');
-                        const qrContainer = document.getElementById('qr-container');
-                        const qrImage = document.getElementById('qr-image');
-                        const printNumber = document.getElementById('print-number');
-                        const status = document.getElementById('status');
-                        const countdown = document.getElementById('countdown');
+                    .then(showLatest)
+                    .catch(error => {
+                        console.error('Error fetching print data:', error);
+                    });
+            }
+            
+            function showLatest(data) {
+                const printDisplay = document.getElementById('print-display');
+                const qrContainer = document.getElementById('qr-container');
+                const printNumber = document.getElementById('print-number');
+                const status = document.getElementById('status');
+                const countdown = document.getElementById('countdown');
+                
+                if (data.exists && data.filename && data.content_filename) {
+                    if (currentPrintNumber !== data.file_number) {
+                        currentPrintNumber = data.file_number;
                         
-                        if (data.exists && data.filename && data.content_filename) {
-                            if (currentPrintNumber !== data.file_number) {
-                                currentPrintNumber = data.file_number;
-                                
-                                fetch(`/print_content/${data.content_filename}`)
-                                    .then(response => response.json())
-                                    .then(contentData => {
-                                        printDisplay.textContent = contentData.content;
-                                        printDisplay.style.display = 'block';
-                                        
-                                        qrImage.src = `/qr/${data.filename}?t=${Date.now()}`;
-                                        qrContainer.style.display = 'flex';
-                                        
-                                        printNumber.textContent = `הדפסה #${data.file_number}`;
-                                        status.textContent = `Print Job #${data.file_number}`;
-                                        
-                                        container.classList.remove('hidden');
-                                        
-                                        if (countdownTimer) clearInterval(countdownTimer);
-                                        if (displayTimer) clearTimeout(displayTimer);
-                                        
-                                        let seconds = 10;
-                                        countdown.textContent = `מוצג למשך ${seconds} שניות... Displaying for ${seconds} seconds...`;
-                                        
-                                        countdownTimer = setInterval(() => {
-                                            seconds--;
-                                            if (seconds > 0) {
-                                                countdown.textContent = `מוצג למשך ${seconds} שניות... Displaying for ${seconds} seconds...`;
-                                            } else {
-                                                countdown.textContent = '';
-                                                clearInterval(countdownTimer);
-                                            }
-                                        }, 1000);
-                                        
-                                        displayTimer = setTimeout(() => {
-                                            container.classList.add('hidden');
-                                            status.textContent = 'הדפסה הוסתרה. ממתין להדפסה הבאה... Print hidden. Waiting for next print job...';
-                                            countdown.textContent = '';
-                                        }, 10000);
-                                    })
-                                    .catch(error => {
-                                        console.error('Error fetching print content:', error);
-                                    });
-                            }
+                        if (typeof data.content === 'string' && data.qr_data_uri) {
+                            // Content and QR code came inline - nothing more to fetch
+                            showJob(data, data.content, data.qr_data_uris || [data.qr_data_uri]);
+                        } else {
+                            fetchJob(data);
+                        }
+                    }
+                } else {
+                    if (!currentPrintNumber) {
+                        printDisplay.innerHTML = '<div class="no-print">אין הדפסה זמינה. ממתין להדפסה...<br>No print available yet. Waiting for print job...</div>';
+                        qrContainer.style.display = 'none';
+                        printNumber.textContent = '';
+                        status.textContent = '';
+                        countdown.textContent = '';
+                    }
+                }
+            }
+            
+            function fetchJob(data) {
+                // inline=1 brings the content and QR image along in one request
+                fetch('/api/latest?inline=1')
+                    .then(response => response.json())
+                    .then(full => {
+                        if (full.file_number === data.file_number && typeof full.content === 'string' && full.qr_data_uri) {
+                            showJob(full, full.content, full.qr_data_uris || [full.qr_data_uri]);
                         } else {
-                            if (!currentPrintNumber) {
-                                printDisplay.innerHTML = '<div class="no-print">אין הדפסה זמינה. ממתין להדפסה...<br>No print available yet. Waiting for print job...</div>';
-                                qrContainer.style.display = 'none';
-                                printNumber.textContent = '';
-                                status.textContent = '';
-                                countdown.textContent = '';
-                            }
+                            fetchJobFiles(data);
                         }
                     })
                     .catch(error => {
@@ -409,45 +374,148 @@ def index():
                     });
             }
             
-            setInterval(updateDisplay, 500);
+            function fetchJobFiles(data) {
+                fetch(`/print_content/${data.content_filename}`)
+                    .then(response => response.json())
+                    .then(contentData => showJob(data, contentData.content, (data.symbols || [data.filename]).map(name => `/qr/${name}`)))
+                    .catch(error => {
+                        console.error('Error fetching print content:', error);
+                    });
+            }
+            
+            function showJob(data, content, qrSrcs) {
+                const container = document.getElementById('container');
+                const printDisplay = document.getElementById('print-display');
+                const qrContainer = document.getElementById('qr-container');
+                const qrImage = document.getElementById('qr-image');
+                const printNumber = document.getElementById('print-number');
+                const status = document.getElementById('status');
+                const countdown = document.getElementById('countdown');
+                
+                printDisplay.textContent = content;
+                printDisplay.style.display = 'block';
+                
+                // Show QR code - job images never change, so the browser cache is safe
+                qrImage.src = qrSrcs[0];
+                qrContainer.style.display = 'flex';
+                
+                printNumber.textContent = `הדפסה #${data.file_number}`;
+                status.textContent = `Print Job #${data.file_number}`;
+
+                // Content split over several QR codes is shown one code at a time, in a loop
+                if (symbolTimer) clearInterval(symbolTimer);
+                symbolTimer = null;
+                if (qrSrcs.length > 1) {
+                    qrSrcs.forEach(src => { new Image().src = src; });
+                    let symbol = 0;
+                    status.textContent = `Print Job #${data.file_number} - QR 1/${qrSrcs.length}`;
+                    symbolTimer = setInterval(() => {
+                        symbol = (symbol + 1) % qrSrcs.length;
+                        qrImage.src = qrSrcs[symbol];
+                        status.textContent = `Print Job #${data.file_number} - QR ${symbol + 1}/${qrSrcs.length}`;
+                    }, SYMBOL_INTERVAL);
+                }
+                
+                container.classList.remove('hidden');
+                
+                if (countdownTimer) clearInterval(countdownTimer);
+                if (displayTimer) clearTimeout(displayTimer);
+                
+                // Long enough to show every QR code of a sequence twice
+                const displaySeconds = Math.max(10, Math.ceil(qrSrcs.length * SYMBOL_INTERVAL * 2 / 1000));
+                let seconds = displaySeconds;
+                countdown.textContent = `מוצג למשך ${seconds} שניות... Displaying for ${seconds} seconds...`;
+                
+                countdownTimer = setInterval(() => {
+                    seconds--;
+                    if (seconds > 0) {
+                        countdown.textContent = `מוצג למשך ${seconds} שניות... Displaying for ${seconds} seconds...`;
+                    } else {
+                        countdown.textContent = '';
+                        clearInterval(countdownTimer);
+                    }
+                }, 1000);
+                
+                displayTimer = setTimeout(() => {
+                    container.classList.add('hidden');
+                    if (symbolTimer) clearInterval(symbolTimer);
+                    status.textContent = 'הדפסה הוסתרה. ממתין להדפסה הבאה... Print hidden. Waiting for next print job...';
+                    countdown.textContent = '';
+                }, displaySeconds * 1000);
+            }
+            
+            // Polling is only a fallback for when the event stream is unavailable
+            let pollTimer = null;
+            
+            function startPolling() {
+                if (!pollTimer) pollTimer = setInterval(updateDisplay, 500);
+            }
+            
+            function stopPolling() {
+                if (pollTimer) clearInterval(pollTimer);
+                pollTimer = null;
+            }
+            
+            function connectEvents() {
+                // The server pushes each new print job as soon as it lands
+                const events = new EventSource('/api/events');
+                events.onopen = stopPolling;
+                events.onmessage = event => showLatest(JSON.parse(event.data));
+                events.onerror = () => {
+                    startPolling();
+                    // Turned away (every stream slot taken) - the browser gives up, so try again later
+                    if (events.readyState === EventSource.CLOSED) setTimeout(connectEvents, 60000);
+                };
+            }
+            
+            if (window.EventSource) {
+                connectEvents();
+            } else {
+                startPolling();
+            }
+            
+            // Initial load
             updateDisplay();
         </script>
     </body>
     </html>
     """
-    return html
+index_page = StaticPage(INDEX_HTML)
+
+
+@display_app.route('/')
+def index():
+    """Main page that displays the print content"""
+    return index_page.response()
 
 
 @display_app.route('/api/latest', methods=['GET'])
 def api_latest():
-    """API endpoint to get latest QR code info"""
-    filename, filepath, content_filename, content_filepath = get_latest_qr_filename()
-    if filename and filepath:
-        try:
-            number = int(filename.replace('.png', ''))
-            return jsonify({
-                'exists': True,
-                'filename': filename,
-                'content_filename': content_filename,
-                'file_number': number
-            }), 200
-        except:
-            pass
-    return jsonify({'exists': False}), 200
+    """API endpoint to get latest QR code info - ?inline=1 adds the content and QR image"""
+    info = latest_job_info()
+    return jsonify(inline_job_info(info) if wants_inline() else info), 200
+
+
+@display_app.route('/api/events', methods=['GET'])
+def api_events():
+    """Server-Sent Events stream announcing each new print job - 503 once every screen slot is taken"""
+    if not job_events.has_room():
+        return event_stream_full_response()
+    return Response(stream_with_context(job_events.stream()),
+                    mimetype='text/event-stream',
+                    headers=event_stream_headers())
 
 
 @display_app.route('/print_content/<filename>', methods=['GET'])
 def display_get_print_content(filename):
     """Get the print content text file"""
     try:
-        filepath = os.path.join(PRINT_CONTENT_DIR, filename)
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                content = f.read()
-            return jsonify({
+        content = content_storage.read_text(filename)
+        if content is not None:
+            return job_json_response({
                 'content': content,
                 'filename': filename
-            }), 200
+            })
         return jsonify({'error': 'Content file not found'}), 404
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -455,84 +523,47 @@ def display_get_print_content(filename):
 
 @display_app.route('/qr/<filename>', methods=['GET'])
 def serve_qr(filename):
-    """Serve QR code image files"""
-    filepath = os.path.join(QR_OUTPUT_DIR, filename)
-    if os.path.exists(filepath):
-        return send_file(filepath, mimetype='image/png')
+    """Serve QR code image files (PNG or SVG)"""
+    mimetype = QR_MIMETYPES.get(os.path.splitext(filename)[1].lstrip('.').lower())
+    filepath = qr_storage.find(filename) if mimetype else None
+    if filepath:
+        return send_job_file(filepath, mimetype)
+    content = qr_storage.read_archived(filename) if mimetype else None
+    if content is not None:
+        return send_job_bytes(content, mimetype)
     return jsonify({'error': 'QR code not found'}), 404
 
 
-def run_display_server():
-    """Run the display server on port 8080"""
+@display_app.route('/metrics', methods=['GET'])
+def display_metrics_endpoint():
+    """Request counts and latency of the display routes in the Prometheus text format"""
+    return Response(display_metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+def run_display_server(server_options=None):
+    """Run the display server on port 8080 - server_options are passed to serving.serve()"""
     print("=" * 60)
     print("QR Display Server Starting...")
     print(f"Display server running on http://localhost:{DISPLAY_SERVER_PORT}")
     print("QR codes will be shown for 10 seconds then disappear")
     print("=" * 60)
-    display_app.run(host='0.0.0.0', port=DISPLAY_SERVER_PORT, debug=False, use_reloader=False)
+    if job_events.latest is None:
+        job_events.publish(inline_job_info(latest_job_info()))
+    job_events.max_subscribers = (server_options or {}).get('screens', SCREENS)
+    serve(display_app, host='0.0.0.0', port=DISPLAY_SERVER_PORT, **(server_options or {}))
 
 
 # ============================================================================
 # FILE WATCHER (Monitors print_input directory)
 # ============================================================================
-class PrintFileHandler(FileSystemEventHandler):
-    """Handle new print files"""
-    
-    def on_created(self, event):
-        if not event.is_directory:
-            time.sleep(0.5)  # Wait for file to be fully written
-            self.process_file(event.src_path)
-    
-    def process_file(self, filepath):
-        """Process a print file and send to printer service"""
-        try:
-            filename = os.path.basename(filepath)
-            print(f"[{datetime.now()}] Processing print file: {filename}")
-            
-            # Read file content
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            
-            if not content.strip():
-                print(f"  Warning: File is empty, skipping...")
-                return
-            
-            # Send to printer service
-            try:
-                response = requests.post(
-                    f"http://localhost:{PRINTER_SERVICE_PORT}/print",
-                    json={'content': content},
-                    timeout=10
-                )
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    print(f"  ✓ QR code created: {result['filename']}")
-                    
-                    # Move file to archive
-                    archive_path = os.path.join(PRINT_ARCHIVE_DIR, filename)
-                    if os.path.exists(filepath):
-                        os.rename(filepath, archive_path)
-                        print(f"  ✓ File archived to: {archive_path}")
-                else:
-                    print(f"  ✗ Error: {response.status_code} - {response.text}")
-                    
-            except requests.exceptions.ConnectionError:
-                print(f"  ✗ Error: Could not connect to printer service")
-                print(f"    Waiting for service to start...")
-            except Exception as e:
-                print(f"  ✗ Error sending to printer service: {str(e)}")
-                
-        except Exception as e:
-            print(f"  ✗ Error processing file: {str(e)}")
+# Jobs are submitted in-process, so there is no printer service to wait for
+print_ingestor = PrintIngestor(ingest_print_file, PRINT_ARCHIVE_DIR, PRINT_PENDING_DIR)
 
 
 def run_file_watcher():
     """Start watching the print input directory"""
-    # Wait a bit for printer service to start
-    time.sleep(2)
-    
-    event_handler = PrintFileHandler()
+    print_ingestor.start()
+    event_handler = PrintFileHandler(print_ingestor, PRINT_INPUT_DIR)
     observer = Observer()
     observer.schedule(event_handler, PRINT_INPUT_DIR, recursive=False)
     observer.start()
@@ -540,18 +571,31 @@ def run_file_watcher():
     print("=" * 60)
     print("Print File Watcher Started")
     print(f"Watching directory: {os.path.abspath(PRINT_INPUT_DIR)}")
-    print(f"Sending to: http://localhost:{PRINTER_SERVICE_PORT}/print")
+    print("Submitting print jobs directly to the printer service")
     print("=" * 60)
+    
+    # Files that arrived while the watcher was not running
+    backlog = print_ingestor.scan(PRINT_INPUT_DIR)
+    if backlog:
+        print(f"Catching up on {backlog} waiting print files...")
+    if print_ingestor.spooled():
+        print(f"Retrying {print_ingestor.spooled()} spooled print files from {os.path.abspath(PRINT_PENDING_DIR)}...")
     print("\nWaiting for print files...\n")
     
     try:
+        last_scan = time.monotonic()
         while True:
             time.sleep(1)
+            # Catch files whose events were missed, e.g. on network shares
+            if RESCAN_INTERVAL and time.monotonic() - last_scan >= RESCAN_INTERVAL:
+                print_ingestor.scan(PRINT_INPUT_DIR)
+                last_scan = time.monotonic()
     except KeyboardInterrupt:
         observer.stop()
         print("\n\nStopping file watcher...")
     
     observer.join()
+    print_ingestor.stop()
     print("File watcher stopped.")
 
 
@@ -559,6 +603,11 @@ def run_file_watcher():
 # MAIN - Start all services
 # ============================================================================
 if __name__ == '__main__':
+    # Both apps and the watcher share this process, so there are no worker processes to choose
+    parser = argparse.ArgumentParser(description="QR printer system - printer service, display server and file watcher")
+    add_server_arguments(parser, servers=('waitress', 'flask'), debug=False, screens=True)
+    server_options = vars(parser.parse_args())
+    
     print("\n" + "=" * 60)
     print("QR PRINTER SYSTEM - Starting All Services")
     print("=" * 60)
@@ -570,14 +619,14 @@ if __name__ == '__main__':
     print("=" * 60 + "\n")
     
     # Start printer service in a thread
-    printer_thread = threading.Thread(target=run_printer_service, daemon=True)
+    printer_thread = threading.Thread(target=run_printer_service, args=(server_options,), daemon=True)
     printer_thread.start()
     
     # Wait a moment for printer service to start
     time.sleep(1)
     
     # Start display server in a thread
-    display_thread = threading.Thread(target=run_display_server, daemon=True)
+    display_thread = threading.Thread(target=run_display_server, args=(server_options,), daemon=True)
     display_thread.start()
     
     # Wait a moment for display server to start
@@ -587,6 +636,9 @@ if __name__ == '__main__':
     watcher_thread = threading.Thread(target=run_file_watcher, daemon=True)
     watcher_thread.start()
     
+    # Roll old jobs into archive segments in the background
+    compactor.start()
+    
     # Keep main thread alive
     try:
         while True:
@@ -0,0 +1,876 @@
+"""
+QR Render - Builds QR code images and caches the encoded bytes by content
+"""
+import os
+import zlib
+import bisect
+import operator
+import functools
+import base64
+import struct
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+import qrcode
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Render settings - less dense, more readable
+BOX_SIZE = 20  # Larger boxes for less density
+BORDER = 8  # Larger border for better spacing
+ERROR_CORRECTION = qrcode.constants.ERROR_CORRECT_M
+# Content beyond one symbol is split into a structured-append sequence of at most this many symbols
+MAX_SYMBOLS = 16
+# Shortest run of digits or capitals qrcode's add_data() gives its own segment - the
+# segmentation versions saved are counted against
+OPTIMIZE = 20
+# Structured append header: mode indicator, symbol position, last position, parity byte
+STRUCTURED_APPEND_MODE = 0b0011
+STRUCTURED_APPEND_BITS = 4 + 4 + 4 + 8
+_SYMBOL_BITS = qrcode.util.BIT_LIMIT_TABLE[ERROR_CORRECTION][40]
+# Most characters the symbols of one job can hold - numeric mode, 10 bits per 3 digits
+_SYMBOL_MAX_CHARS = (_SYMBOL_BITS - STRUCTURED_APPEND_BITS) * 3 // 10
+MAX_QR_CHARS = MAX_SYMBOLS * _SYMBOL_MAX_CHARS
+# Most bits the symbols of one job can hold
+MAX_QR_BITS = MAX_SYMBOLS * (_SYMBOL_BITS - STRUCTURED_APPEND_BITS)
+# UTF-8 bytes that fit in one symbol whatever they are - a single byte-mode segment
+_ALWAYS_FITS_BYTES = (_SYMBOL_BITS - 4 - 16) // 8
+# Mask pattern (0-7) applied to every symbol, or None to pick the one with the lowest penalty
+# score. A fixed mask skips scoring altogether - for latency-critical kiosks; any mask decodes
+MASK_PATTERN = None
+# zlib level for the 1-bit PNG - 9 makes files about a quarter smaller but encodes 3x slower
+PNG_COMPRESS_LEVEL = 6
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Default memory budget for cached PNG bytes
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Worker processes for parallel renders - one per core
+RENDER_WORKERS = os.cpu_count() or 1
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+class QRCapacityError(ValueError):
+    """Content too large for MAX_SYMBOLS QR codes"""
+
+
+# Module rows of the 1:1:3:1:1 finder-like pattern penalized with light modules either side
+_FINDER_LIKE = (True, False, True, True, True, False, True, False, False, False, False)
+
+
+# Segment modes, and the cost of one character in each, in sixths of a bit (byte mode: per UTF-8 byte)
+_MODES = (qrcode.util.MODE_NUMBER, qrcode.util.MODE_ALPHA_NUM, qrcode.util.MODE_8BIT_BYTE, qrcode.util.MODE_KANJI)
+_CHAR_COSTS = (20, 33, 48, 78)
+_DIGITS = frozenset('0123456789')
+_ALPHANUMERIC = frozenset(qrcode.util.ALPHA_NUM.decode('ascii'))
+# Version ranges over which the length fields keep their size
+_VERSION_BANDS = ((1, 9), (10, 26), (27, 40))
+_ASCII = bytes(range(128))
+
+
+class _KanjiSegment:
+    """Kanji-mode segment, 13 bits per double-byte Shift JIS character - qrcode's QRData does not write them"""
+
+    mode = qrcode.util.MODE_KANJI
+
+    def __init__(self, text):
+        self.data = text.encode('shift_jis')
+
+    def __len__(self):
+        return len(self.data) // 2
+
+    def write(self, buffer):
+        for index in range(0, len(self.data), 2):
+            code = self.data[index] << 8 | self.data[index + 1]
+            code -= 0x8140 if code <= 0x9FFC else 0xC140
+            buffer.put((code >> 8) * 0xC0 + (code & 0xFF), 13)
+
+
+@functools.lru_cache(maxsize=4096)
+def _kanji_encodable(char):
+    """
+    Whether char has a Kanji-mode code - a double-byte Shift JIS character
+    that the JIS and Microsoft tables map alike, so every reader decodes it
+    back to char
+    """
+    try:
+        code = char.encode('shift_jis')
+        if len(code) != 2 or code != char.encode('cp932'):
+            return False
+    except UnicodeEncodeError:
+        return False
+    value = code[0] << 8 | code[1]
+    return 0x8140 <= value <= 0x9FFC or 0xE040 <= value <= 0xEBBF
+
+
+def _char_modes(data, version):
+    """
+    Mode of each character in the shortest encoding of data at version (and
+    its band) - dynamic programming over where to switch modes. Each step
+    keeps the cheapest encoding so far ending in each mode; a switch ends the
+    segment, rounding its bits up, and pays the next mode's header.
+    """
+    heads = [(4 + qrcode.util.length_in_bits(mode, version)) * 6 for mode in _MODES]
+    costs = list(heads)
+    steps = []
+    for char in data:
+        encodable = (char in _DIGITS, char in _ALPHANUMERIC, True, char >= '\x80' and _kanji_encodable(char))
+        byte_cost = _CHAR_COSTS[2] * len(char.encode('utf-8'))
+        new_costs = [None] * 4
+        previous = [None] * 4
+        for mode in range(4):
+            if encodable[mode]:
+                new_costs[mode] = costs[mode] + (byte_cost if mode == 2 else _CHAR_COSTS[mode])
+                previous[mode] = mode
+        # Or end the segment here and start the next character in another mode
+        for target in range(4):
+            for mode in range(4):
+                if previous[mode] == mode:
+                    switched = -(-new_costs[mode] // 6) * 6 + heads[target]
+                    if new_costs[target] is None or switched < new_costs[target]:
+                        new_costs[target] = switched
+                        previous[target] = mode
+        costs = new_costs
+        steps.append(previous)
+
+    mode = min(range(4), key=lambda index: -(-costs[index] // 6))
+    modes = [None] * len(data)
+    for index in range(len(data) - 1, -1, -1):
+        mode = steps[index][mode]
+        modes[index] = mode
+    return modes
+
+
+def _optimal_segments(data, version):
+    """data split into the segments of its shortest encoding at version"""
+    segments = []
+    start = 0
+    modes = _char_modes(data, version)
+    for index in range(1, len(data) + 1):
+        if index < len(data) and modes[index] == modes[start]:
+            continue
+        text = data[start:index]
+        mode = _MODES[modes[start]]
+        if mode == qrcode.util.MODE_KANJI:
+            segments.append(_KanjiSegment(text))
+        else:
+            segments.append(qrcode.util.QRData(text.encode('utf-8'), mode=mode, check_data=False))
+        start = index
+    return segments
+
+
+def _payload_bits(mode, count):
+    """Bits of count characters (bytes in byte mode) in mode, without the header"""
+    if mode == qrcode.util.MODE_NUMBER:
+        return count // 3 * 10 + (0, 4, 7)[count % 3]
+    if mode == qrcode.util.MODE_ALPHA_NUM:
+        return count // 2 * 11 + count % 2 * 6
+    if mode == qrcode.util.MODE_KANJI:
+        return count * 13
+    return count * 8
+
+
+def _segment_bits(segment, version):
+    """Encoded length of one segment - mode, length field and payload"""
+    return 4 + qrcode.util.length_in_bits(segment.mode, version) + _payload_bits(segment.mode, len(segment))
+
+
+def _fit_version(segments, extra_bits=0):
+    """Smallest version holding segments plus extra_bits, or None if not even version 40 does"""
+    limits = qrcode.util.BIT_LIMIT_TABLE[ERROR_CORRECTION]
+    for low, high in _VERSION_BANDS:
+        bits = sum(_segment_bits(segment, low) for segment in segments) + extra_bits
+        version = bisect.bisect_left(limits, bits, low, high + 1)
+        if version <= high:
+            return version
+    return None
+
+
+def _plan_segments(data, extra_bits=0):
+    """
+    (version, segments) of the smallest version holding data, optimally
+    segmented for that version, plus extra_bits - (None, None) if not even
+    version 40 does
+    """
+    limits = qrcode.util.BIT_LIMIT_TABLE[ERROR_CORRECTION]
+    for low, high in _VERSION_BANDS:
+        # At least 10 bits per 3 characters - skip the bands that cannot hold data
+        if len(data) * 10 // 3 + extra_bits > limits[high]:
+            continue
+        segments = _optimal_segments(data, low)
+        bits = sum(_segment_bits(segment, low) for segment in segments) + extra_bits
+        version = bisect.bisect_left(limits, bits, low, high + 1)
+        if version <= high:
+            return version, segments
+    return None, None
+
+
+def default_version(data, append=None):
+    """Version data needs with qrcode's add_data() segmentation, or None if it does not fit"""
+    segments = list(qrcode.util.optimal_data_chunks(data, minimum=OPTIMIZE))
+    return _fit_version(segments, 0 if append is None else STRUCTURED_APPEND_BITS)
+
+
+class _PartBits:
+    """
+    Bits of consecutive characters of data encoded with the modes of one
+    segmentation of the whole, one character at a time - parts cut from an
+    optimal segmentation fit at least as well when each is segmented anew
+    """
+
+    def __init__(self, data, modes, version):
+        self.data = data
+        self.modes = modes
+        self.heads = [4 + qrcode.util.length_in_bits(mode, version) for mode in _MODES]
+        self.closed = 0  # Bits of the segments before the current one
+        self.mode = None
+        self.count = 0
+
+    def add(self, index):
+        """Add data[index], returns the bits of the part so far"""
+        mode = self.modes[index]
+        units = len(self.data[index].encode('utf-8')) if mode == 2 else 1
+        if mode != self.mode:
+            if self.mode is not None:
+                self.closed += self.heads[self.mode] + _payload_bits(_MODES[self.mode], self.count)
+            self.mode = mode
+            self.count = 0
+        self.count += units
+        return self.closed + self.heads[mode] + _payload_bits(_MODES[mode], self.count)
+
+
+def _split_parts(data):
+    """Split data into the fewest parts that each fit one structured-append symbol, evened out when possible"""
+    capacity = _SYMBOL_BITS - STRUCTURED_APPEND_BITS
+    modes = _char_modes(data, 40)
+    parts = []
+    start = 0
+    while start < len(data):
+        if len(parts) == MAX_SYMBOLS:
+            raise QRCapacityError(f"Content too large for {MAX_SYMBOLS} QR codes ({len(data.encode('utf-8'))} bytes)")
+        # Longest run of characters that still fits
+        part = _PartBits(data, modes, 40)
+        end = start
+        while end < len(data) and part.add(end) <= capacity:
+            end += 1
+        parts.append(data[start:end])
+        start = end
+    # Parts of equal length render at similar sizes - use them if they fit too
+    size = -(-len(data) // len(parts))
+    even = [(index, min(index + size, len(data))) for index in range(0, len(data), size)]
+    if len(even) == len(parts) and all(_slice_fits(data, modes, start, end, capacity) for start, end in even):
+        return [data[start:end] for start, end in even]
+    return parts
+
+
+def _slice_fits(data, modes, start, end, capacity):
+    part = _PartBits(data, modes, 40)
+    return all(part.add(index) <= capacity for index in range(start, end))
+
+
+def least_bits(encoded, chars):
+    """
+    Fewest bits chars characters, UTF-8 encoded as encoded, take in any
+    segmentation - from the bytes alone, without the character-level step:
+    an ASCII byte takes at least 10/3 bits (a digit in numeric mode), any
+    other character at least 13 (Kanji). Rounded down, so it adds up over
+    the chunks of a stream.
+    """
+    ascii_bytes = len(encoded) - len(encoded.translate(None, _ASCII))
+    return (ascii_bytes * 10 + (chars - ascii_bytes) * 39) // 3
+
+
+def plan_symbols(data):
+    """
+    How data is laid out in QR symbols: [(data, None, plan)] when it fits in
+    one, else [(part, (position, total, parity), plan), ...] for a
+    structured-append sequence. plan is the symbol's (version, segments) for
+    build_matrix() where the check already worked it out, else None - pass
+    the layout on so a job is segmented once. Only encoded bit lengths are
+    computed - nothing is drawn. Raises QRCapacityError when MAX_SYMBOLS
+    symbols are not enough.
+    """
+    encoded = data.encode('utf-8')
+    if len(encoded) <= _ALWAYS_FITS_BYTES:
+        return [(data, None, None)]
+    if len(data) > MAX_QR_CHARS:
+        raise QRCapacityError(f"Content too large for {MAX_SYMBOLS} QR codes ({len(data)} characters, at most {MAX_QR_CHARS})")
+    # MAX_QR_CHARS counts every character as a digit - multibyte text is refused here, before segmenting it
+    if least_bits(encoded, len(data)) > MAX_QR_BITS:
+        raise QRCapacityError(f"Content too large for {MAX_SYMBOLS} QR codes ({len(encoded)} bytes)")
+    plan = _plan_segments(data)
+    if plan[0] is not None:
+        return [(data, None, plan)]
+    parts = _split_parts(data)
+    # Readers check the reassembled message against the XOR of all its bytes
+    parity = functools.reduce(operator.xor, encoded, 0)
+    return [(part, (position, len(parts), parity), None) for position, part in enumerate(parts)]
+
+
+def check_capacity(data):
+    """Number of QR symbols data needs, 1 to MAX_SYMBOLS - raises QRCapacityError beyond that"""
+    return len(plan_symbols(data))
+
+
+def _structured_append_data(version, segments, append):
+    """Codewords of one structured-append symbol - qrcode.util.create_data() with the header in front"""
+    position, total, parity = append
+    buffer = qrcode.util.BitBuffer()
+    buffer.put(STRUCTURED_APPEND_MODE, 4)
+    buffer.put(position, 4)
+    buffer.put(total - 1, 4)
+    buffer.put(parity, 8)
+    for segment in segments:
+        buffer.put(segment.mode, 4)
+        buffer.put(len(segment), qrcode.util.length_in_bits(segment.mode, version))
+        segment.write(buffer)
+
+    rs_blocks = qrcode.base.rs_blocks(version, ERROR_CORRECTION)
+    bit_limit = sum(block.data_count * 8 for block in rs_blocks)
+    # Terminator, byte alignment, then alternating pad bytes up to capacity
+    for _ in range(min(bit_limit - len(buffer), 4)):
+        buffer.put_bit(False)
+    if len(buffer) % 8:
+        for _ in range(8 - len(buffer) % 8):
+            buffer.put_bit(False)
+    for index in range((bit_limit - len(buffer)) // 8):
+        buffer.put(qrcode.util.PAD0 if index % 2 == 0 else qrcode.util.PAD1, 8)
+    return qrcode.util.create_bytes(buffer, rs_blocks)
+
+
+@functools.lru_cache(maxsize=None)
+def _mask_layers(version):
+    """
+    Data module positions of a version, and where each of the 8 mask
+    patterns flips them, as numpy arrays - (size, size) and (8, size, size)
+    """
+    size = version * 4 + 17
+    probe = qrcode.QRCode(version=version, error_correction=ERROR_CORRECTION)
+    probe.modules_count = size
+    probe.modules = [[None] * size for _ in range(size)]
+    # Every function pattern makeImpl() draws - what is left holds the data
+    probe.setup_position_probe_pattern(0, 0)
+    probe.setup_position_probe_pattern(size - 7, 0)
+    probe.setup_position_probe_pattern(0, size - 7)
+    probe.setup_position_adjust_pattern()
+    probe.setup_timing_pattern()
+    probe.setup_type_info(True, 0)
+    if version >= 7:
+        probe.setup_type_number(True)
+    data_area = numpy.array([[module is None for module in row] for row in probe.modules])
+
+    # qrcode.util.mask_func() for whole arrays, i the row and j the column
+    i, j = numpy.indices((size, size))
+    masks = numpy.array([
+        (i + j) % 2 == 0,
+        i % 2 == 0,
+        j % 3 == 0,
+        (i + j) % 3 == 0,
+        (i // 2 + j // 3) % 2 == 0,
+        (i * j) % 2 + (i * j) % 3 == 0,
+        ((i * j) % 2 + (i * j) % 3) % 2 == 0,
+        ((i * j) % 3 + (i + j) % 2) % 2 == 0,
+    ])
+    return data_area, masks & data_area
+
+
+def _penalties(candidates):
+    """qrcode.util.lost_point() of each of a stack of module matrices, all at once"""
+    count, size, _ = candidates.shape
+    scores = numpy.zeros(count, dtype=numpy.int64)
+    for lines in (candidates, candidates.transpose(0, 2, 1)):
+        same = lines[:, :, 1:] == lines[:, :, :-1]
+        # A run of 5 or more costs its length - 2: one per 5-module window in it, plus 2 at its start
+        windows = same[:, :, :-3] & same[:, :, 1:-2] & same[:, :, 2:-1] & same[:, :, 3:]
+        starts = windows.copy()
+        starts[:, :, 1:] &= ~same[:, :, :-4]
+        scores += windows.sum(axis=(1, 2)) + 2 * starts.sum(axis=(1, 2))
+        for pattern in (_FINDER_LIKE, _FINDER_LIKE[::-1]):
+            found = numpy.ones((count, size, size - 10), dtype=bool)
+            for offset, dark in enumerate(pattern):
+                found &= lines[:, :, offset:size - 10 + offset] == dark
+            scores += 40 * found.sum(axis=(1, 2))
+
+    corner = candidates[:, :-1, :-1]
+    blocks = (corner == candidates[:, :-1, 1:]) & (corner == candidates[:, 1:, :-1]) & (corner == candidates[:, 1:, 1:])
+    scores += 3 * blocks.sum(axis=(1, 2))
+
+    # Same float arithmetic as qrcode, so ties go the same way
+    for index, dark in enumerate(candidates.sum(axis=(1, 2)).tolist()):
+        scores[index] += int(abs(float(dark) / (size ** 2) * 100 - 50) / 5) * 10
+    return scores
+
+
+def _make_best_masked(qr):
+    """
+    qr.makeImpl() with the mask qrcode's best_mask_pattern() picks, for qr
+    whose version and data_cache are set - returns the mask. The symbol is
+    laid out once and the 8 masks scored together with numpy, instead of
+    laying it out and scoring it in Python 8 times.
+    """
+    qr.makeImpl(True, 0)
+    _, flips = _mask_layers(qr.version)
+    candidates = numpy.array(qr.modules, dtype=bool) ^ flips[0] ^ flips
+    mask_pattern = int(numpy.argmin(_penalties(candidates)))
+    # Candidates were scored with blank format and version information, as qrcode does - fill it in
+    qr.modules = candidates[mask_pattern].tolist()
+    qr.setup_type_info(False, mask_pattern)
+    if qr.version >= 7:
+        qr.setup_type_number(False)
+    return mask_pattern
+
+
+def build_matrix(data, append=None, mask_pattern=None, plan=None):
+    """
+    Module matrix for data, border included - True is a dark module. With
+    append=(position, total, parity) data is one symbol of a structured-append
+    sequence, as planned by plan_symbols(); plan is the symbol's (version,
+    segments) from there, if it has one.
+
+    data is split into the numeric, alphanumeric, byte and Kanji segments of
+    its shortest encoding, the version comes straight from the capacity table
+    and the data is encoded once; the mask is mask_pattern, else MASK_PATTERN,
+    else the best scoring.
+    """
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=ERROR_CORRECTION,
+        border=BORDER,
+    )
+
+    if plan is None:
+        plan = _plan_segments(data, 0 if append is None else STRUCTURED_APPEND_BITS)
+    qr.version, segments = plan
+    if append is None:
+        if qr.version is None:
+            raise QRCapacityError(f"Content too large for one QR code ({len(data.encode('utf-8'))} bytes)")
+        qr.data_cache = qrcode.util.create_data(qr.version, ERROR_CORRECTION, segments)
+    else:
+        qr.data_cache = _structured_append_data(qr.version, segments, append)
+
+    if mask_pattern is None:
+        mask_pattern = MASK_PATTERN
+    if mask_pattern is not None:
+        qr.makeImpl(False, mask_pattern)
+    elif numpy is not None:
+        _make_best_masked(qr)
+    else:
+        qr.makeImpl(False, qr.best_mask_pattern())
+    return qr.get_matrix()
+
+
+def _png_chunk(kind, payload):
+    return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+
+
+def matrix_to_png(matrix, box_size=BOX_SIZE):
+    """
+    Encode a module matrix as a black-on-white 1-bit grayscale PNG.
+
+    Each module row is packed into one scanline; the repeated scanlines use
+    the PNG "Up" filter, so they are all zero bytes and zlib compresses them
+    almost for free. The pixels are the same as qrcode's make_image() draws,
+    without drawing each module as a rectangle.
+    """
+    size = len(matrix)
+    width = size * box_size
+    row_bytes = (width + 7) // 8
+    dark = '0' * box_size  # 0 is black in a 1-bit grayscale PNG
+    light = '1' * box_size
+    padding = '0' * (row_bytes * 8 - width)
+    unchanged = b'\x02' + bytes(row_bytes)
+
+    scanlines = []
+    previous = None
+    for row in matrix:
+        bits = ''.join([dark if module else light for module in row]) + padding
+        if bits == previous:
+            scanlines.append(unchanged * box_size)
+            continue
+        scanlines.append(b'\x00' + int(bits, 2).to_bytes(row_bytes, 'big'))
+        scanlines.append(unchanged * (box_size - 1))
+        previous = bits
+
+    header = struct.pack('>IIBBBBB', width, width, 1, 0, 0, 0, 0)
+    return b''.join([
+        PNG_SIGNATURE,
+        _png_chunk(b'IHDR', header),
+        _png_chunk(b'IDAT', zlib.compress(b''.join(scanlines), PNG_COMPRESS_LEVEL)),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+def matrix_to_svg(matrix, box_size=BOX_SIZE):
+    """
+    Encode a module matrix as an SVG - a single path where each horizontal run
+    of dark modules is one stroked line, reached with a relative move
+    """
+    size = len(matrix)
+    commands = []
+    for y, row in enumerate(matrix):
+        x = 0
+        end = None  # Where the previous run in this row ended
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            if end is None:
+                commands.append(f"M{start} {y}.5h{x - start}")
+            else:
+                commands.append(f"m{start - end} 0h{x - start}")
+            end = x
+
+    pixels = size * box_size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/>'
+        f'<path d="{"".join(commands)}" stroke="#000" stroke-width="1"/></svg>'
+    ).encode('utf-8')
+
+
+# Output formats: encoder and the mimetype they are served with
+ENCODERS = {
+    'png': matrix_to_png,
+    'svg': matrix_to_svg,
+}
+MIMETYPES = {
+    'png': 'image/png',
+    'svg': 'image/svg+xml',
+}
+
+
+def matrix_version(matrix):
+    """QR version (1-40) of a module matrix built by build_matrix()"""
+    return (len(matrix) - 2 * BORDER - 17) // 4
+
+
+def qr_data_uri(content, fmt):
+    """data: URI of an encoded QR code, to inline it in a JSON response"""
+    return f"data:{MIMETYPES[fmt]};base64,{base64.b64encode(content).decode('ascii')}"
+
+
+def render_qr(data, formats=('png',), append=None, plan=None):
+    """Render data as a QR code once and encode it in every format, returns {format: bytes}"""
+    matrix = build_matrix(data, append, plan=plan)
+    return {fmt: ENCODERS[fmt](matrix) for fmt in formats}
+
+
+def render_qr_timed(data, formats=('png',), append=None, plan=None):
+    """
+    render_qr() plus how it went, for metrics: returns ({format: bytes},
+    {'make_seconds', 'encode_seconds', 'version', 'versions_saved'}), the
+    last being how many versions smaller the symbol is than with qrcode's
+    add_data() segmentation. Runs in the render pool, so the timings travel
+    back with the result.
+    """
+    start = time.perf_counter()
+    matrix = build_matrix(data, append, plan=plan)
+    built = time.perf_counter()
+    rendered = {fmt: ENCODERS[fmt](matrix) for fmt in formats}
+    timings = {
+        'make_seconds': built - start,
+        'encode_seconds': time.perf_counter() - built,
+        'version': matrix_version(matrix),
+    }
+    # Parts split to fill a symbol may not fit qrcode's segmentation at all - nothing to compare then
+    default = default_version(data, append)
+    timings['versions_saved'] = default - timings['version'] if default else 0
+    return rendered, timings
+
+
+def render_qr_png(data):
+    """Render data as a QR code and return the encoded PNG bytes"""
+    return matrix_to_png(build_matrix(data))
+
+
+def get_render_pool():
+    """Process pool shared by everything that renders in parallel, created on first use"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+        return _render_pool
+
+
+def render_digest(formats=('png',)):
+    """
+    sha256 object primed with the render settings - update it with the UTF-8
+    content, e.g. chunk by chunk while it is received, to get its render_key()
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{','.join(formats)}|{ERROR_CORRECTION}|{BOX_SIZE}|{BORDER}|{PNG_COMPRESS_LEVEL}|{MASK_PATTERN}\n".encode('utf-8'))
+    return digest
+
+
+def render_key(data, formats=('png',)):
+    """Hash of the content plus every setting that changes the rendered files"""
+    digest = render_digest(formats)
+    digest.update(data.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def rendered_size(rendered):
+    """Bytes held by {format: bytes}, or by a list of them for a structured-append sequence"""
+    symbols = rendered if isinstance(rendered, list) else [rendered]
+    return sum(len(content) for symbol in symbols for content in symbol.values())
+
+
+def rendered_version(rendered):
+    """
+    QR version of a render (the largest of a structured-append sequence),
+    read back from the size of the encoded image - also for cache hits
+    """
+    versions = []
+    for symbol in (rendered if isinstance(rendered, list) else [rendered]):
+        if 'png' in symbol:
+            modules = struct.unpack('>I', symbol['png'][16:20])[0] // BOX_SIZE
+        else:
+            modules = int(symbol['svg'].split(b'viewBox="0 0 ', 1)[1].split(b' ', 1)[0])
+        versions.append((modules - 2 * BORDER - 17) // 4)
+    return max(versions)
+
+
+class QRRenderCache:
+    """
+    Content-addressed cache of rendered QR codes.
+
+    Entries hold the encoded bytes of every requested format, keyed by a hash
+    of the content and render settings: {format: bytes}, or a list of them,
+    one per symbol, for content split into a structured-append sequence. The memory tier is an LRU bounded by
+    the total size of the cached bytes. The optional disk tier keeps every
+    render under cache_dir so repeats are also served after a restart.
+
+    on_render, if set, is called with the timings of render_qr_timed() after
+    every actual render.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, cache_dir=None, on_render=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.on_render = on_render
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, key, fmt):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{fmt}")
+
+    def _remember(self, key, rendered):
+        """Add to the memory tier, evicting least recently used entries"""
+        size = rendered_size(rendered)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = rendered
+            self._size += size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= rendered_size(evicted)
+
+    def _read_disk(self, key, formats):
+        if not self.cache_dir:
+            return None
+        try:
+            # A symbol count is written after the symbols of a structured-append render
+            with open(self._disk_path(key, 'symbols'), 'r') as f:
+                count = int(f.read())
+        except (OSError, ValueError):
+            count = None
+        names = [key] if count is None else [f"{key}-{position}" for position in range(1, count + 1)]
+        symbols = []
+        try:
+            for name in names:
+                rendered = {}
+                for fmt in formats:
+                    with open(self._disk_path(name, fmt), 'rb') as f:
+                        rendered[fmt] = f.read()
+                symbols.append(rendered)
+        except OSError:
+            return None
+        return symbols[0] if count is None else symbols
+
+    def _write_file(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _write_disk(self, key, rendered):
+        if not self.cache_dir:
+            return
+        if not isinstance(rendered, list):
+            for fmt, content in rendered.items():
+                self._write_file(self._disk_path(key, fmt), content)
+            return
+        for position, symbol in enumerate(rendered, 1):
+            for fmt, content in symbol.items():
+                self._write_file(self._disk_path(f"{key}-{position}", fmt), content)
+        self._write_file(self._disk_path(key, 'symbols'), str(len(rendered)).encode('ascii'))
+
+    def _rendered(self, data, formats, results, key=None):
+        """
+        Store the render_qr_timed() results of data's symbols and report their
+        timings, returns {format: bytes} - or a list of them for several symbols
+        """
+        rendered = [symbol for symbol, _ in results]
+        if len(rendered) == 1:
+            rendered = rendered[0]
+        self.put(data, formats, rendered, key)
+        if self.on_render is not None:
+            for _, timings in results:
+                self.on_render(timings)
+        return rendered
+
+    def _submit(self, data, formats, executor, layout=None):
+        """Futures rendering every symbol data needs - layout is its plan_symbols(), if already known"""
+        return [executor.submit(render_qr_timed, part, formats, append, plan)
+                for part, append, plan in layout or plan_symbols(data)]
+
+    def get(self, data, formats=('png',), key=None):
+        """Cached {format: bytes} for data, or None - key is its render_key() if already known"""
+        key = key or render_key(data, formats)
+        with self._lock:
+            rendered = self._entries.get(key)
+            if rendered is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return rendered
+        rendered = self._read_disk(key, formats)
+        if rendered is not None:
+            with self._lock:
+                self.disk_hits += 1
+            self._remember(key, rendered)
+        return rendered
+
+    def put(self, data, formats, rendered, key=None):
+        """Store rendered {format: bytes} for data"""
+        key = key or render_key(data, formats)
+        self._remember(key, rendered)
+        self._write_disk(key, rendered)
+
+    def get_or_render(self, data, formats=('png',), key=None, layout=None):
+        """
+        {format: bytes} for data, rendering only on a cache miss. Content split
+        over several symbols gives a list, its symbols rendered in parallel.
+        layout is data's plan_symbols(), if already known.
+        """
+        rendered = self.get(data, formats, key)
+        if rendered is None:
+            with self._lock:
+                self.misses += 1
+            layout = layout or plan_symbols(data)
+            if len(layout) == 1:
+                results = [render_qr_timed(data, formats, plan=layout[0][2])]
+            else:
+                futures = [get_render_pool().submit(render_qr_timed, part, formats, append, plan)
+                           for part, append, plan in layout]
+                results = [future.result() for future in futures]
+            rendered = self._rendered(data, formats, results, key)
+        return rendered
+
+    def render_async(self, data, formats=('png',), executor=None, layout=None):
+        """Future resolving to {format: bytes} for data - a miss renders on executor, following layout if given"""
+        rendered = self.get(data, formats)
+        if rendered is not None:
+            future = Future()
+            future.set_result(rendered)
+            return future
+
+        with self._lock:
+            self.misses += 1
+        result = Future()
+        try:
+            symbols = self._submit(data, formats, executor or get_render_pool(), layout)
+        except QRCapacityError as e:
+            result.set_exception(e)
+            return result
+        remaining = [len(symbols)]
+        remaining_lock = threading.Lock()
+
+        def remember(done):
+            with remaining_lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            try:
+                result.set_result(self._rendered(data, formats, [symbol.result() for symbol in symbols]))
+            except Exception as e:
+                result.set_exception(e)
+
+        for symbol in symbols:
+            symbol.add_done_callback(remember)
+        return result
+
+    def render_many(self, items, formats=('png',), executor=None, layouts=None):
+        """
+        {format: bytes} (a list of them for content needing several symbols)
+        for every item, in order. Cache misses are rendered in
+        parallel on executor; a failed render yields its exception in place
+        of the result so one bad item does not fail the others. layouts are
+        the items' plan_symbols(), if already known.
+        """
+        results = [self.get(data, formats) for data in items]
+        pending = OrderedDict()
+        known = {}
+        for index, (data, rendered) in enumerate(zip(items, results)):
+            if rendered is None:
+                pending.setdefault(data, []).append(index)
+                if layouts is not None:
+                    known.setdefault(data, layouts[index])
+        if not pending:
+            return results
+
+        with self._lock:
+            self.misses += len(pending)
+        executor = executor or get_render_pool()
+        futures = []
+        for data in pending:
+            try:
+                futures.append((data, self._submit(data, formats, executor, known.get(data))))
+            except QRCapacityError as e:
+                futures.append((data, e))
+        for data, symbols in futures:
+            try:
+                if isinstance(symbols, Exception):
+                    raise symbols
+                rendered = self._rendered(data, formats, [symbol.result() for symbol in symbols])
+            except Exception as e:
+                rendered = e
+            for index in pending[data]:
+                results[index] = rendered
+        return results
+
+    def stats(self):
+        """Hit/miss counters and memory usage"""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_ratio': round(hits / lookups, 4) if lookups else 0.0,
+                'entries': len(self._entries),
+                'memory_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'disk_enabled': bool(self.cache_dir),
+            }
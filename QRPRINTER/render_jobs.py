@@ -0,0 +1,71 @@
+"""
+Render Jobs - Renders accepted print jobs in the background and tracks their status
+"""
+import time
+import threading
+from collections import OrderedDict
+
+# How many finished jobs keep their status in memory
+MAX_TRACKED_JOBS = 10000
+
+
+class RenderJobs:
+    """
+    Background rendering for print jobs that were accepted before their QR
+    code exists. Renders run on the render process pool so throughput scales
+    with the number of cores; the files are written once the worker returns.
+    """
+
+    def __init__(self, render_cache, max_tracked=MAX_TRACKED_JOBS):
+        self.render_cache = render_cache
+        self.max_tracked = max_tracked
+        self._changed = threading.Condition()
+        self._jobs = OrderedDict()
+
+    def submit(self, job_id, data, save, formats=('png',), on_done=None, on_failed=None, layout=None, **info):
+        """
+        Queue data for rendering, following layout (its plan_symbols()) if
+        given. save(job_id, rendered) writes the files and on_done(job_id) runs
+        after it, or on_failed(job_id, error) if either fails; info is
+        reported with the job status.
+        """
+        job = dict(info, job_id=job_id, status='queued', submitted_at=time.time())
+        with self._changed:
+            self._jobs[job_id] = job
+            while len(self._jobs) > self.max_tracked:
+                self._jobs.popitem(last=False)
+
+        future = self.render_cache.render_async(data, formats, layout=layout)
+        future.add_done_callback(lambda done: self._complete(job, save, done, on_done, on_failed))
+        return dict(job)
+
+    def _complete(self, job, save, future, on_done, on_failed):
+        """Write the rendered files and record the outcome"""
+        try:
+            save(job['job_id'], future.result())
+            if on_done:
+                on_done(job['job_id'])
+            status, error = 'done', None
+        except Exception as e:
+            print(f"Error rendering print job #{job['job_id']}: {str(e)}")
+            status, error = 'failed', str(e)
+            if on_failed:
+                try:
+                    on_failed(job['job_id'], error)
+                except Exception as e:
+                    print(f"Error recording failed print job #{job['job_id']}: {str(e)}")
+
+        with self._changed:
+            job['status'] = status
+            job['completed_at'] = time.time()
+            if error:
+                job['error'] = error
+            self._changed.notify_all()
+
+    def status(self, job_id, wait=0):
+        """Status of a tracked job, waiting up to wait seconds for it to finish"""
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is not None and wait > 0:
+                self._changed.wait_for(lambda: job['status'] != 'queued', timeout=wait)
+            return dict(job) if job is not None else None
@@ -0,0 +1,123 @@
+"""
+Serving - Runs the Flask apps on a production WSGI server
+
+waitress (multi-threaded, works on Windows) is used when it is installed.
+gunicorn adds worker processes on Linux and macOS. Without either, the apps
+fall back to Flask's built-in development server.
+
+Worker processes can share one data directory: job numbers are reserved
+in blocks under a file lock, job files are written under unique names and
+counter.txt is replaced atomically. Render job status, the render cache's
+memory tier and /metrics are per process.
+
+Every screen connected to /api/events holds a server thread for as long as it
+is connected, so apps that stream get a thread per screen on top of their
+request threads. Screens beyond that limit are turned away with a 503 and
+poll /api/latest instead, and the request threads stay free for everyone else.
+"""
+import os
+import argparse
+import importlib.util
+
+SERVERS = ('waitress', 'gunicorn', 'flask')
+# Default server and its settings
+SERVER = 'waitress'
+THREADS = 16  # Request threads per process, not counting the ones held by screens
+SCREENS = 64  # Screens that can hold an /api/events stream per process - each gets its own thread
+WORKERS = 1  # Processes, gunicorn only
+TIMEOUT = 60  # Seconds before a stalled request (or idle connection on waitress) is dropped
+KEEPALIVE = 5  # Seconds an idle keep-alive connection stays open (gunicorn)
+
+
+def _installed(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def _at_least(minimum):
+    """argparse type for a whole number of at least minimum"""
+    def parse(value):
+        number = int(value)
+        if number < minimum:
+            raise argparse.ArgumentTypeError(f"must be at least {minimum}")
+        return number
+    return parse
+
+
+def add_server_arguments(parser, port=None, servers=SERVERS, debug=True, screens=False):
+    """
+    Add the serving options to an argparse parser - their names match
+    serve()'s arguments. screens adds --screens for apps serving /api/events.
+    """
+    if port is not None:
+        parser.add_argument('--host', default='0.0.0.0', help="address to listen on")
+        parser.add_argument('--port', type=int, default=port, help="port to listen on")
+    parser.add_argument('--server', choices=servers, default=SERVER, help=f"WSGI server (default {SERVER})")
+    parser.add_argument('--threads', type=_at_least(1), default=THREADS,
+                        help="request threads per process, besides the ones held by screens")
+    if screens:
+        parser.add_argument('--screens', type=_at_least(0), default=SCREENS,
+                            help=f"screens that can stay connected to /api/events per process (default {SCREENS}); "
+                                 "more are told to poll")
+    if 'gunicorn' in servers:
+        parser.add_argument('--workers', type=int, default=WORKERS, help="worker processes (gunicorn)")
+    parser.add_argument('--timeout', type=int, default=TIMEOUT, help="request timeout in seconds")
+    parser.add_argument('--keepalive', type=int, default=KEEPALIVE, help="keep-alive timeout in seconds (gunicorn)")
+    if debug:
+        parser.add_argument('--debug', action='store_true', help="Flask development server with debugger and reloader")
+
+
+def resolve_server(server, workers=WORKERS, debug=False):
+    """The server that will actually run - falls back when the chosen one is not available"""
+    if debug:
+        return 'flask'
+    if server == 'gunicorn' and (os.name == 'nt' or not _installed('gunicorn')):
+        print("  gunicorn is not available here - using waitress")
+        server = 'waitress'
+    if server == 'waitress' and not _installed('waitress'):
+        print("  waitress is not installed (pip install waitress) - using Flask's development server")
+        server = 'flask'
+    if workers > 1 and server != 'gunicorn':
+        print(f"  {server} runs a single process - ignoring --workers {workers}")
+    return server
+
+
+def serve(app, host='0.0.0.0', port=5000, server=SERVER, threads=THREADS, workers=WORKERS,
+          timeout=TIMEOUT, keepalive=KEEPALIVE, debug=False, screens=0):
+    """Serve app until interrupted - with threads for requests plus one for each of screens event streams"""
+    if threads < 1 or screens < 0:
+        raise ValueError(f"Need at least 1 request thread and no negative screen count, got {threads} and {screens}")
+    server = resolve_server(server, workers, debug)
+    if screens:
+        print(f"  {threads} request threads + {screens} for screens on /api/events")
+        threads += screens
+    if server == 'gunicorn':
+        _serve_gunicorn(app, host, port, workers, threads, timeout, keepalive)
+    elif server == 'waitress':
+        from waitress import serve as waitress_serve
+        options = {}
+        if app.config.get('MAX_CONTENT_LENGTH'):
+            # waitress buffers whole bodies before the app sees them - refuse oversized ones up front.
+            # Its limit is per server, so /print bodies up to this size are still received (see README)
+            options['max_request_body_size'] = app.config['MAX_CONTENT_LENGTH']
+        waitress_serve(app, host=host, port=port, threads=threads, channel_timeout=timeout, ident='QR Printer',
+                       **options)
+    else:
+        app.run(host=host, port=port, debug=debug, use_reloader=debug, threaded=True)
+
+
+def _serve_gunicorn(app, host, port, workers, threads, timeout, keepalive):
+    from gunicorn.app.base import BaseApplication
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('timeout', timeout)
+            self.cfg.set('keepalive', keepalive)
+
+        def load(self):
+            return app
+
+    Application().run()
@@ -0,0 +1,119 @@
+"""
+Tests for print file pickup - run with: python -m unittest test_print_ingest
+"""
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from watchdog.observers import Observer
+from print_ingest import CLOSE_EVENTS, PrintFileHandler, PrintIngestor
+
+
+class SlowWriterTest(unittest.TestCase):
+    """A writer that pauses between writes must not have its file submitted half-written"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.root, 'print_input')
+        self.archive_dir = os.path.join(self.root, 'print_archive')
+        os.makedirs(self.input_dir)
+        self.submitted = []
+        self.done = threading.Event()
+        self.ingestor = None
+        self.observer = None
+
+    def tearDown(self):
+        if self.observer:
+            self.observer.stop()
+            self.observer.join()
+        if self.ingestor:
+            self.ingestor.stop()
+        shutil.rmtree(self.root)
+
+    def submit(self, content):
+        self.submitted.append(content)
+        self.done.set()
+        return {'filename': f"{len(self.submitted)}.png"}
+
+    def watch(self, **options):
+        self.ingestor = PrintIngestor(self.submit, self.archive_dir, workers=1, poll_interval=0.05, **options)
+        self.ingestor.start()
+        self.observer = Observer()
+        self.observer.schedule(PrintFileHandler(self.ingestor, self.input_dir), self.input_dir, recursive=False)
+        self.observer.start()
+
+    def write_slowly(self, pause):
+        path = os.path.join(self.input_dir, 'slow.txt')
+        with open(path, 'w') as f:
+            f.write("first half ")
+            f.flush()
+            time.sleep(pause)
+            f.write("second half")
+        return path
+
+    def assert_submitted_whole(self):
+        self.assertTrue(self.done.wait(10), "file was never submitted")
+        time.sleep(0.2)  # A second submission would show up by now
+        self.assertEqual(self.submitted, ["first half second half"])
+        self.assertTrue(os.path.exists(os.path.join(self.archive_dir, 'slow.txt')))
+
+    @unittest.skipUnless(CLOSE_EVENTS, "platform does not report file closes")
+    def test_waits_for_close(self):
+        # Pauses far longer than the quiet period are fine once closes are reported
+        self.watch(quiet_period=0.3)
+        self.write_slowly(1.5)
+        self.assert_submitted_whole()
+
+    def test_quiet_period_without_close_events(self):
+        self.watch(quiet_period=3, close_events=False)
+        self.write_slowly(1.5)
+        self.assertFalse(self.done.is_set())
+        self.assert_submitted_whole()
+
+    def test_default_quiet_period_is_short(self):
+        # Without close events every file waits out the quiet period - it must stay around a second
+        self.watch(close_events=False)
+        started = time.monotonic()
+        with open(os.path.join(self.input_dir, 'slow.txt'), 'w') as f:
+            f.write("first half second half")
+        self.assert_submitted_whole()
+        self.assertLess(time.monotonic() - started, 3)
+
+    def test_scanned_file_needs_no_close(self):
+        # Found on disk, just written - no close event will ever come for it
+        self.ingestor = PrintIngestor(self.submit, self.archive_dir, workers=1, poll_interval=0.05,
+                                      quiet_period=0.3, close_events=True)
+        self.ingestor.start()
+        with open(os.path.join(self.input_dir, 'slow.txt'), 'w') as f:
+            f.write("first half second half")
+        self.ingestor.scan(self.input_dir)
+        self.assert_submitted_whole()
+
+    def test_moved_in_from_outside(self):
+        # Written elsewhere, then moved in - no open or close happens in the watched directory
+        self.watch(quiet_period=0.3)
+        outside = os.path.join(self.root, 'slow.txt')
+        with open(outside, 'w') as f:
+            f.write("first half second half")
+        os.rename(outside, os.path.join(self.input_dir, 'slow.txt'))
+        self.assert_submitted_whole()
+
+    def test_scan_takes_file_left_open(self):
+        # Reported opened, but its close was missed - a rescan takes it once it stops changing
+        self.ingestor = PrintIngestor(self.submit, self.archive_dir, workers=1, poll_interval=0.05,
+                                      quiet_period=0.3, close_events=True)
+        self.ingestor.start()
+        path = os.path.join(self.input_dir, 'slow.txt')
+        with open(path, 'w') as f:
+            f.write("first half second half")
+        self.ingestor.notify(path, opened=True)
+        time.sleep(0.6)
+        self.assertFalse(self.done.is_set())
+        self.ingestor.scan(self.input_dir)
+        self.assert_submitted_whole()
+
+
+if __name__ == '__main__':
+    unittest.main()
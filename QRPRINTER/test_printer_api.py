@@ -0,0 +1,112 @@
+"""
+Tests for the printer endpoints - run with: python -m unittest test_printer_api
+"""
+import os
+import time
+import shutil
+import tempfile
+import unittest
+from flask import Flask
+
+printer_api = None
+client = None
+_cwd = _root = None
+
+
+def setUpModule():
+    # printer_api keeps its files in the working directory, from its import on
+    global printer_api, client, _cwd, _root
+    _cwd = os.getcwd()
+    _root = tempfile.mkdtemp()
+    os.chdir(_root)
+    import printer_api
+    app = Flask(__name__)
+    app.register_blueprint(printer_api.api)
+    client = app.test_client()
+
+
+def tearDownModule():
+    os.chdir(_cwd)
+    shutil.rmtree(_root)
+
+
+class MixedBatchTest(unittest.TestCase):
+    """One odd item in a batch fails (or prints) on its own, not the whole request"""
+
+    def test_mixed_types(self):
+        jobs = [{'content': 'ok'}, {'content': 123}, {'text': ['a', 'b']}, {'content': {'table': 4}},
+                {'content': None}, 456, None, '', 'plain']
+        response = client.post('/print/batch', json=jobs)
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertEqual([result['success'] for result in results],
+                         [True, True, True, True, True, True, False, False, True])
+        self.assertEqual(response.get_json()['succeeded'], 7)
+        printed = [printer_api.content_storage.read_text(result['content_filename'])
+                   for result in results if result['success']]
+        self.assertEqual(printed, ['ok', '123', '["a", "b"]', '{"table": 4}', '{"content": null}', '456', 'plain'])
+
+    def test_one_item_too_large(self):
+        response = client.post('/print/batch', json=[{'content': 'ok'}, {'content': 'ש' * 80000}])
+        self.assertEqual(response.status_code, 200)
+        results = response.get_json()['results']
+        self.assertTrue(results[0]['success'])
+        self.assertFalse(results[1]['success'])
+        self.assertIn('too large', results[1]['error'])
+
+
+class BodyLimitTest(unittest.TestCase):
+    """Each route refuses a body over its own limit from the Content-Length alone"""
+
+    def test_declared_length_over_route_limit(self):
+        # Only one byte is sent - the refusal must come from the header
+        response = client.post('/print', data=b'x', content_type='text/plain',
+                               environ_overrides={'CONTENT_LENGTH': str(printer_api.MAX_PRINT_BYTES + 1)})
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('too large', response.get_json()['error'])
+
+    def test_batch_takes_larger_bodies(self):
+        jobs = [{'content': 'x' * 1000} for _ in range(1500)]
+        response = client.post('/print/batch', json=jobs)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['succeeded'], 1500)
+
+
+class JobStatusTest(unittest.TestCase):
+    """?wait= never blocks a request thread for longer than MAX_JOB_WAIT"""
+
+    def setUp(self):
+        # Queued in the index as if another process were rendering it
+        self.job_id = printer_api.job_sequence.reserve(1)[0]
+        printer_api.job_index.add(self.job_id, 'queued elsewhere')
+
+    def test_bad_waits_refused(self):
+        for wait in ('nan', 'inf', '-inf', '-5', 'soon', ''):
+            started = time.monotonic()
+            response = client.get(f'/jobs/{self.job_id}?wait={wait}')
+            self.assertEqual(response.status_code, 400, wait)
+            self.assertLess(time.monotonic() - started, 1, wait)
+
+    def test_wait_on_queued_job(self):
+        started = time.monotonic()
+        response = client.get(f'/jobs/{self.job_id}?wait=0.3')
+        self.assertEqual(response.get_json()['status'], 'queued')
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+    def test_stale_queued_job_failed(self):
+        index = printer_api.job_index
+        index._connection().execute('UPDATE jobs SET submitted_at = ? WHERE number = ?',
+                                    (time.time() - 3600, self.job_id))
+        index._connection().commit()
+        self.assertEqual(index.fail_stale(), 1)
+        job = client.get(f'/jobs/{self.job_id}').get_json()
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('stopped', job['error'])
+        # A job queued just now may still be rendering in another process
+        fresh = printer_api.job_sequence.reserve(1)[0]
+        index.add(fresh, 'just queued')
+        self.assertEqual(index.fail_stale(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()